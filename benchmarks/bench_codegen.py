@@ -0,0 +1,65 @@
+"""
+Compares plain `validate` against the compiled plan
+and the code generating backend on a flat schema made
+of built-in validators.
+
+Run with:
+    python benchmarks/bench_codegen.py
+
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from validator import (Required, Range, GreaterThan, LessThan, Equals, In,
+                       Length, InstanceOf, Truthy, Blank, Not, And, Or,
+                       validate, compile)
+
+validation = {
+    "id": [Required, InstanceOf(int), GreaterThan(0)],
+    "name": [Required, Length(1, maximum=64)],
+    "age": [Range(0, 150)],
+    "score": [GreaterThan(0, inclusive=True), LessThan(100)],
+    "kind": [Required, In(["a", "b", "c"])],
+    "active": [Truthy()],
+    "note": [Or(Blank(), Length(3, maximum=140))],
+    "version": [Equals(2)],
+    "tag": [Not(In(["banned", "spam"])), And(InstanceOf(str), Length(1))],
+}
+
+passes = {
+    "id": 42, "name": "spam", "age": 30, "score": 99.5, "kind": "b",
+    "active": True, "note": "", "version": 2, "tag": "eggs",
+}
+
+fails = {
+    "id": -1, "name": "", "age": 200, "score": 100, "kind": "d",
+    "active": 0, "note": "no", "version": 3, "tag": "spam",
+}
+
+
+def main(number=20000):
+    plan = compile(validation)
+    generated = compile(validation, backend="codegen")
+    for doc in (passes, fails):
+        assert plan.validate(doc) == generated.validate(doc) == validate(validation, doc)
+
+    for label, doc in (("passing", passes), ("failing", fails)):
+        timings = [
+            ("validate()", lambda: validate(validation, doc)),
+            ("compile()", lambda: plan.validate(doc)),
+            ("codegen", lambda: generated.validate(doc)),
+        ]
+        baseline = None
+        print("%s document, %d runs" % (label, number))
+        for name, func in timings:
+            seconds = min(timeit.repeat(func, number=number, repeat=3))
+            baseline = baseline or seconds
+            print("  %-12s %10.0f ops/sec  %5.2fx" % (name, number / seconds, baseline / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Benchmarks for the validation hot paths.
+
+Each workload is timed for ops/sec and run once more under
+tracemalloc for its peak memory use. Results can be saved
+as JSON and compared against a previous run, e.g. the last
+release:
+
+    python benchmarks/bench_validator.py --output 1.3.0.json
+    python benchmarks/bench_validator.py --compare 1.3.0.json
+
+Use --filter to run only the workloads whose names contain
+a given string, and --min-time to trade accuracy for speed.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import validator
+from validator import (Required, Range, GreaterThan, LessThan, Equals, In,
+                       Length, InstanceOf, Truthy, Blank, Not, And, Or, If,
+                       Then, Each, OneOf, Pattern, Email, Url, validate, compile)
+
+
+def flat_schema():
+    validation = {}
+    passes = {}
+    fails = {}
+    for i in range(10):
+        validation["int%d" % i] = [Required, InstanceOf(int), Range(0, 100)]
+        validation["str%d" % i] = [Required, Length(1, maximum=32)]
+        validation["opt%d" % i] = [GreaterThan(0), LessThan(10, inclusive=True)]
+        validation["enum%d" % i] = [In(["spam", "eggs", "ham"])]
+        validation["flag%d" % i] = [Truthy()]
+        passes.update({"int%d" % i: i, "str%d" % i: "value", "opt%d" % i: 5,
+                       "enum%d" % i: "eggs", "flag%d" % i: True})
+        fails.update({"int%d" % i: -i, "str%d" % i: "", "opt%d" % i: 50,
+                      "enum%d" % i: "bacon", "flag%d" % i: 0})
+    return validation, passes, fails
+
+
+def nested_schema(depth=10):
+    validation = {"leaf": [Required, Equals(depth)]}
+    document = {"leaf": depth}
+    for level in range(depth - 1, -1, -1):
+        validation = {"value": [Required, Range(0, 100)], "child": [Required, validation]}
+        document = {"value": level, "child": document}
+    return validation, document
+
+
+def if_then_schema(rules=30):
+    validation = {"type": [Required] + [
+        If(Equals("kind%d" % i), Then({"payload": [Required, {"size": [Range(0, i)]}]}))
+        for i in range(rules)
+    ]}
+    return validation, {"type": "kind%d" % (rules - 1), "payload": {"size": 3}}
+
+
+def one_of_schema(rules=30):
+    return OneOf("type", dict(
+        ("kind%d" % i, {"payload": [Required, {"size": [Range(0, i)]}]})
+        for i in range(rules)
+    ))
+
+
+def tree(depth):
+    if depth == 0:
+        return Or(Blank(), Length(3, maximum=10))
+    return Or(And(InstanceOf(str), tree(depth - 1)), Not(tree(depth - 1)))
+
+
+def workloads():
+    flat, flat_passes, flat_fails = flat_schema()
+    flat_compiled = compile(flat)
+    flat_generated = compile(flat, backend="codegen")
+    nested, nested_document = nested_schema()
+    nested_compiled = compile(nested)
+    if_then, if_then_document = if_then_schema()
+    one_of = one_of_schema()
+    each_list = {"values": [Each([Range(0, 10)])]}
+    each_list_document = {"values": list(range(10)) * 10000}
+    each_dict = {"rows": [Each({"id": [Required, InstanceOf(int)], "name": [Length(1)]})]}
+    each_dict_document = {"rows": [{"id": i, "name": "row"} for i in range(10000)]}
+    trees = {"field%d" % i: [tree(4)] for i in range(10)}
+    trees_document = dict(("field%d" % i, "x" * i) for i in range(10))
+    allowlist = {"sku": [In(["SKU%06d" % i for i in range(200000)])]}
+    allowlist_documents = [{"sku": "SKU%06d" % i} for i in range(0, 200000, 2000)]
+    strings = {
+        "code": [Pattern(r"[A-Z]{3}-\d{4}")],
+        "email": [Email()],
+        "website": [Url()],
+    }
+    strings_document = {
+        "code": "ABC-1234",
+        "email": "someone." * 20 + "name@example.com",
+        "website": "https://example.com/" + "path/" * 50,
+    }
+    return [
+        ("flat_50_keys_valid", lambda: validate(flat, flat_passes)),
+        ("flat_50_keys_invalid", lambda: validate(flat, flat_fails)),
+        ("flat_50_keys_compiled", lambda: flat_compiled.validate(flat_passes)),
+        ("flat_50_keys_codegen", lambda: flat_generated.validate(flat_passes)),
+        ("flat_50_keys_is_valid", lambda: flat_compiled.is_valid(flat_passes)),
+        ("flat_50_keys_fail_fast", lambda: flat_compiled.validate(flat_fails, fail_fast=True)),
+        ("nested_depth_10", lambda: validate(nested, nested_document)),
+        ("nested_depth_10_compiled", lambda: nested_compiled.validate(nested_document)),
+        ("if_then_chain_30", lambda: validate(if_then, if_then_document)),
+        ("one_of_30", lambda: validate(one_of, if_then_document)),
+        ("each_list_100k", lambda: validate(each_list, each_list_document)),
+        ("each_dict_10k", lambda: validate(each_dict, each_dict_document)),
+        ("or_and_trees", lambda: validate(trees, trees_document)),
+        ("in_allowlist_200k", lambda: [validate(allowlist, d) for d in allowlist_documents]),
+        ("strings_pattern_email_url", lambda: validate(strings, strings_document)),
+        ("email_adversarial_100k", lambda: validate(strings, {"email": "aa@" + "a" * 100000 + "!!"})),
+    ]
+
+
+def measure(func, min_time):
+    # time enough calls to fill min_time, then take the best of 3
+    number = 1
+    while True:
+        seconds = timeit.timeit(func, number=number)
+        if seconds >= min_time / 3:
+            break
+        number *= 2
+    best = min([seconds] + timeit.repeat(func, number=number, repeat=2))
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"ops_per_sec": number / best, "peak_memory_bytes": peak}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="save the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--filter", default="", help="only run workloads whose names contain this")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to time each workload for")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for name, func in workloads():
+        if args.filter not in name:
+            continue
+        result = results[name] = measure(func, args.min_time)
+        line = "%-28s %12.1f ops/sec %10.1f KiB peak" % (
+            name, result["ops_per_sec"], result["peak_memory_bytes"] / 1024.0)
+        if name in baseline:
+            line += "  %5.2fx" % (result["ops_per_sec"] / baseline[name]["ops_per_sec"])
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "version": validator.__version__,
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
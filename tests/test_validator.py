@@ -21,6 +21,9 @@
 
 from validator import *
 from validator.ext import *
+import json
+import pickle
+import validator
 import pytest
 
 class BaseClass(object):
@@ -484,3 +487,985 @@ class TestValidator(object):
         valid,errors = validate(validation, fails)
         assert not valid
         assert len(errors) == len(fails)
+
+    def test_compiled_schema(self):
+        validation = {
+            "foo": [Required, Equals(1)],
+            "bar": [{"baz": [Required, Range(0, 5)]}],
+            "qux": [If(Equals(1), Then({"zot": [Required]}))],
+            "spam": [Each({"eggs": [Required, In([1, 2])]})],
+            "ham": Equals(5),
+            "lamb": Required
+        }
+        schema = compile(validation)
+        assert compile(schema) is schema
+        assert schema.required == frozenset(["foo", "lamb"])
+        test_cases = [
+            {"foo": 1, "ham": 5, "lamb": 0},
+            {"foo": 2, "bar": {"baz": 9}, "qux": 1, "spam": [{"eggs": 3}, {}]},
+            {"bar": {}, "qux": 2, "spam": "nope"},
+        ]
+        for test_case in test_cases:
+            assert schema.validate(test_case) == validate(validation, test_case)
+        assert schema.validate(test_cases[1]) == (False, {
+            "foo": ["must be equal to 1"],
+            "bar": [{"baz": ["must fall between 0 and 5"]}],
+            "qux": [{"zot": ["must be present"]}],
+            "spam": [{0: {"eggs": ["must be one of [1, 2]"]}, 1: {"eggs": ["must be present"]}}],
+            "ham": ["must be equal to 5"],
+            "lamb": ["must be present"]
+        })
+
+    def test_compiled_schema_cycles(self):
+        tree = {"value": [Required, InstanceOf(int)]}
+        tree["child"] = [tree]
+        schema = compile(tree)
+        assert schema.validate({"value": 1, "child": {"value": 2}})[0]
+        assert schema.validate({"value": 1, "child": {"value": 2, "child": {}}}) == (
+            False, {"child": [{"child": [{"value": ["must be present"]}]}]})
+
+    def test_codegen_backend(self):
+        class Odd(Equals):
+            def __call__(self, value):
+                return value % 2 == 1
+        validation = {
+            "foo": [Required, Range(0, 10), Not(Equals(3))],
+            "bar": [Length(2, maximum=4), Or(Blank(), And(InstanceOf(str), Truthy()))],
+            "baz": [In([1, 2]), GreaterThan(0), LessThan(5, inclusive=True)],
+            "qux": [lambda x: x == "qux", Odd(1), {"quux": [Required]}],
+            "spam": Equals(5),
+            "eggs": Required
+        }
+        schema = compile(validation, backend="codegen")
+        assert isinstance(schema, GeneratedSchema)
+        assert "Range" not in schema.source
+        test_cases = [
+            {"foo": 5, "bar": "abc", "baz": 1, "spam": 5, "eggs": 1},
+            {"foo": 3, "bar": 5, "baz": "x", "qux": {"quux": 1}},
+            {"foo": "x", "bar": [1, 2], "baz": 9, "qux": {}},
+            {},
+        ]
+        for test_case in test_cases:
+            assert schema.validate(test_case) == validate(validation, test_case)
+        with pytest.raises(ValueError):
+            compile(validation, backend="jit")
+
+    def test_codegen_parity_with_raising_values(self):
+        class Ambiguous(object):
+            def __bool__(self):
+                raise ValueError("truth value is ambiguous")
+            __nonzero__ = __bool__
+
+        class Unindexable(dict):
+            def __getitem__(self, key):
+                raise KeyError(key)
+
+        validation = {
+            "flag": [Truthy()],
+            "lone": Truthy(),
+            "nested": [{"inner": [Truthy(), Range(0, 5)]}],
+        }
+        test_cases = [
+            {"flag": Ambiguous(), "lone": Ambiguous()},
+            {"nested": "a string"},
+            {"nested": {"inner": Ambiguous()}},
+            Unindexable(flag=1, lone=1),
+        ]
+        for backend in ("plan", "codegen"):
+            schema = compile(validation, backend=backend)
+            for test_case in test_cases:
+                expected = validate(validation, test_case)
+                assert schema.validate(test_case) == expected
+                assert schema.is_valid(test_case) == expected.valid
+
+    def test_validate_many(self):
+        validation = {
+            "foo": [Required, Range(0, 10)],
+            "bar": [InstanceOf(str)]
+        }
+        records = [{"foo": 1}, {"foo": 11, "bar": 1}, {"bar": "x"}, {"foo": 0, "bar": "y"}]
+        results = validate_many(validation, iter(records))
+        assert list(results) == [(i, validate(validation, r)) for i, r in enumerate(records)]
+        summary = validate_many(validation, iter(records), summary=True)
+        assert summary == BatchSummary(invalid=[1, 2], error_counts={"foo": 2, "bar": 1})
+        generated = compile(validation, backend="codegen")
+        assert validate_many(generated, records, summary=True) == summary
+
+    def test_validate_columns(self):
+        np = pytest.importorskip("numpy")
+        columns = {
+            "id": np.array([1, 5, 11, -2]),
+            "name": np.array(["", "ab", "abcdef", "x"]),
+            "misc": np.array([1, "x", None, 2.0], dtype=object)
+        }
+        either = Or(In([1, 11, "x"]), GreaterThan(3))
+        validation = {
+            "id": [Required, Range(0, 10), either],
+            "name": [Length(1, maximum=4), Not(Blank())],
+            "misc": [InstanceOf(int), lambda x: x != "x"],
+            "missing": [Required]
+        }
+        valid, errors = validate_columns(validation, columns)
+        assert not valid
+        errors = dict((key, dict((msg, rows.tolist()) for msg, rows in failures.items()))
+                      for key, failures in errors.items())
+        assert errors == {
+            "id": {
+                "must fall between 0 and 10": [2, 3],
+                either.err_message: [3]
+            },
+            "name": {
+                "must be between 1 and 4 elements in length": [0, 2],
+                "must not be an empty string": [0]
+            },
+            "misc": {
+                "must be an instance of int or its subclasses": [1, 2, 3],
+                "failed validation": [1]
+            },
+            "missing": {"must be present": [0, 1, 2, 3]}
+        }
+        for row in range(4):
+            record = dict((key, column.tolist()[row]) for key, column in columns.items())
+            row_errors = validate(validation, record).errors
+            assert sorted(row_errors) == sorted(key for key in errors if any(
+                row in rows for rows in errors[key].values()))
+        with pytest.raises(ValueError):
+            validate_columns({"id": [{"foo": [Required]}]}, columns)
+
+        # In on a string is a substring test, row by row and by column
+        substrings = {"text": [In("abc")], "raw": [Not(In("abc"))]}
+        columns = {"text": np.array(["ab", "bc", "ac"]), "raw": np.array([b"a", b"ab", b"x"])}
+        errors = validate_columns(substrings, columns).errors
+        assert dict((key, dict((msg, rows.tolist()) for msg, rows in failures.items()))
+                    for key, failures in errors.items()) == {
+            "text": {"must be one of 'abc'": [2]},
+            "raw": {"must not be one of 'abc'": [0, 1, 2]},
+        }
+        assert validate(substrings, {"text": "ab", "raw": b"a"}).errors == {"raw": ["must not be one of 'abc'"]}
+
+        # missing columns fail just like missing keys do
+        lone = {"text": [In("abc")], "gone": Range(0, 1), "also_gone": [Range(0, 1)], "required": Required}
+        errors = validate_columns(lone, {"text": np.array(["a", "b"])}).errors
+        assert dict((key, dict((msg, rows.tolist()) for msg, rows in failures.items()))
+                    for key, failures in errors.items()) == {
+            "gone": {"must fall between 0 and 1": [0, 1]},
+            "required": {"must be present": [0, 1]},
+        }
+        assert sorted(validate(lone, {"text": "a"}).errors) == sorted(errors)
+        with pytest.raises(ValueError):
+            validate_columns({"a": [Truthy()]}, {"a": np.array([1, 2]), "b": np.array([1])})
+
+    def test_pickling(self):
+        def handler(a, b, c=1):
+            pass
+        validation = {
+            "foo": [Required, In([1, 2]), Not(Range(5, 6)), Or(Blank(), Length(1, maximum=3))],
+            "bar": [Each({"baz": [Pattern(r"\d+"), Email(), Url()]})],
+            "qux": [If(Equals(1), Then({"quux": [GreaterThan(0), LessThan(3)]}))],
+            "spam": [And(InstanceOf(str), Truthy()), Contains("a"), SubclassOf(object)],
+            "eggs": [ArgSpec("a", "b", c=1)]
+        }
+        test_case = {
+            "foo": 7, "bar": [{"baz": "12"}, {"baz": "x"}], "qux": 1, "quux": 5,
+            "spam": "ham", "eggs": handler
+        }
+        unpickled = pickle.loads(pickle.dumps(validation))
+        assert validate(unpickled, test_case) == validate(validation, test_case)
+
+    def test_validate_parallel(self):
+        validation = {
+            "foo": [Required, Range(0, 10)],
+            "bar": [Pattern(r"\d+")]
+        }
+        records = [{"foo": i, "bar": str(i) if i % 3 else "x"} for i in range(20)]
+        results = validate_parallel(validation, iter(records), workers=2, chunksize=3)
+        assert list(results) == list(validate_many(validation, records))
+        generated = compile(validation, backend="codegen")
+        results = validate_parallel(generated, records, workers=2, chunksize=7)
+        assert list(results) == list(validate_many(validation, records))
+
+    def test_fail_fast(self):
+        validation = {
+            "foo": [Required, Range(0, 10), Equals(5)],
+            "bar": [Each([Range(0, 10)])],
+            "baz": [Each({"qux": [Required, Equals(1)], "quux": [Required]})],
+            "zot": [If(Equals(1), Then({"spam": [Required, Equals(1)], "eggs": [Required]}))],
+            "ham": [{"lamb": [Equals(1)], "veal": [Equals(2)]}]
+        }
+        fails = {
+            "foo": 11,
+            "bar": [20] * 50000,
+            "baz": [{}] * 50000,
+            "zot": 1,
+            "ham": {"lamb": 2, "veal": 3}
+        }
+        expected = [
+            ("foo", ["must fall between 0 and 10"]),
+            ("bar", ["all values must fall between 0 and 10"]),
+            ("baz", [{0: {"qux": ["must be present"]}}]),
+            ("zot", [{"spam": ["must be present"]}]),
+            ("ham", [{"lamb": ["must be equal to 1"]}]),
+        ]
+        passes = {"foo": 5, "bar": [1], "baz": [{"qux": 1, "quux": 0}], "zot": 2, "ham": {}}
+        for backend in ("plan", "codegen"):
+            schema = compile(validation, backend)
+            test_case = dict(fails)
+            for key, errors in expected:
+                assert schema.validate(test_case, fail_fast=True) == (False, {key: errors})
+                assert validate(validation, test_case, fail_fast=True) == (False, {key: errors})
+                test_case[key] = passes[key]
+            assert schema.validate(test_case, fail_fast=True) == (True, {})
+
+    def test_is_valid(self):
+        validation = {
+            "foo": [Required, Length(2), Not(Equals("xx"))],
+            "bar": [Each([Range(0, 10)]), lambda x: (True, [])],
+            "baz": [Each({"qux": [Required]})],
+            "zot": [If(Equals(1), Then({"spam": [Required]}))],
+            "lamb": [{"ham": [InstanceOf(int)]}],
+            "eggs": Equals(5)
+        }
+        test_cases = [
+            {"foo": "abc", "bar": [1, 2], "baz": [{"qux": 1}], "eggs": 5},
+            {"foo": 12, "eggs": 5},
+            {"foo": "xx", "eggs": 5},
+            {"foo": "abc"},
+            {"foo": "abc", "bar": [1, 11], "eggs": 5},
+            {"foo": "abc", "bar": 5, "eggs": 5},
+            {"foo": "abc", "baz": [{}], "eggs": 5},
+            {"foo": "abc", "zot": 1, "eggs": 5},
+            {"foo": "abc", "zot": 2, "eggs": 5},
+            {"foo": "abc", "lamb": {"ham": "x"}, "eggs": 5},
+        ]
+        for backend in ("plan", "codegen"):
+            schema = compile(validation, backend)
+            for test_case in test_cases:
+                assert schema.is_valid(test_case) is validate(validation, test_case).valid
+                assert is_valid(validation, test_case) is validate(validation, test_case).valid
+        assert [is_valid(validation, test_case) for test_case in test_cases] == [
+            True, False, False, False, False, False, False, False, True, False]
+
+    def test_in_validator_index(self):
+        skus = list(range(200000))
+        assert In(skus).index_kind == "hash"
+        assert In(skus)(199999)
+        assert not In(skus)(-1)
+        assert not In(skus)([1])
+        assert Not(In(skus))([1])
+        pairs = In([[1, 2], [0, 1], [3]])
+        assert pairs.index_kind == "sorted"
+        assert pairs([0, 1]) and pairs([3]) and not pairs([1])
+        assert not pairs(1)
+        sets = [[{3}], [{1}], [{2}], [{1, 2}], [{5}]]
+        assert In(sets).index_kind == "none"
+        assert all(In(sets)(element) for element in sets)
+        assert In([[1, "a"], [2]]).index_kind == "none"
+        assert In([[float("nan")], [1]]).index_kind == "none"
+        assert In([[1.5, [2]], [1]]).index_kind == "sorted"
+        assert In([{"a": 1}, {"b": 2}]).index_kind == "none"
+        assert In([{"a": 1}, {"b": 2}])({"b": 2})
+        assert In("abc").index_kind == "none"
+        assert In("abc")("bc")
+        assert In([1, 2], index="sorted")(2)
+        assert In([1, 2], index="none").index_kind == "none"
+        with pytest.raises(ValueError):
+            In([1], index="btree")
+        with pytest.raises(TypeError):
+            In([[1]], index="hash")
+        assert validate({"foo": [In([1, 2, 3])]}, {"foo": 4}) == (
+            False, {"foo": ["must be one of [1, 2, 3]"]})
+
+    def test_messages_of_plain_callables(self):
+        either = Or(lambda x: x == 1, Blank())
+        both = And(lambda x: x != 1, Not(lambda x: x == 2))
+        validation = {"a": [either], "b": [both]}
+        expected = (False, {
+            "a": ["must validate in ['failed validation', 'must be an empty string']"],
+            "b": ["must validate all ['failed validation', 'failed validation']"],
+        })
+        assert validate(validation, {"a": 2, "b": 2}) == expected
+        for backend in ("plan", "codegen"):
+            assert compile(validation, backend=backend).validate({"a": 2, "b": 2}) == expected
+            assert compile(optimize(validation), backend=backend).validate({"a": 2, "b": 2}) == expected
+
+    def test_lazy_messages(self):
+        import validator
+        allowlist = In(list(range(200000)))
+        either = Or(allowlist, Equals(-1))
+        negated = Not(either)
+        for v in (allowlist, either, negated, either.validators[1]):
+            assert not hasattr(v, "_err_message")
+            assert not hasattr(v, "_not_message")
+        assert negated.err_message == either.not_message
+        assert len(allowlist.err_message) > 1000000
+        small = In([1, 2, 3, 4, 5])
+        small.err_message = "must be small"
+        assert validate({"foo": [small]}, {"foo": 6}) == (False, {"foo": ["must be small"]})
+        validator.MESSAGE_ITEMS_LIMIT = 3
+        try:
+            assert In([1, 2, 3, 4, 5]).err_message == "must be one of [1, 2, 3, ...]"
+            assert In(["spam" * 50]).err_message == "must be one of [%r]" % ("spam" * 50)
+            assert Not(Equals((1, 2, 3, 4))).err_message == "must not be equal to (1, 2, 3, ...)"
+        finally:
+            validator.MESSAGE_ITEMS_LIMIT = None
+
+    def test_email_validator_matches_old_pattern(self):
+        import random
+        import re
+        old = re.compile(r"^[^.].+@([?)[a-zA-Z0-9-.])+.([a-zA-Z]{2,3}|[0-9]{1,3})(]?)$")
+        parts = ["a", "b.", ".", "@", "\n", "[1.2.3.4]", "com", "c", "12", "1234", "]", "-", "?", " ", "\xe9"]
+        rng = random.Random(0)
+        email = Email()
+        for _ in range(20000):
+            value = "".join(rng.choice(parts) for _ in range(rng.randint(0, 8)))
+            assert bool(email(value)) == bool(old.match(value)), repr(value)
+        with pytest.raises(TypeError):
+            email(5)
+
+    def test_email_validator_adversarial(self):
+        import time
+        email = Email()
+        adversarial = [
+            "a" + "@" * 100000,
+            "aa" + "@a" * 50000 + "@!",
+            "aa@" + "a" * 100000 + "!!",
+            "aa@" + "." * 100000 + "\n!",
+            "a" * 100000 + "@" + "-" * 100000 + "com]]",
+        ]
+        for value in adversarial:
+            start = time.time()
+            assert not email(value)
+            assert time.time() - start < 0.5
+        start = time.time()
+        assert email("a" * 100000 + "@" + "b" * 100000 + ".com")
+        assert time.time() - start < 0.5
+
+    def test_pattern_registry(self):
+        registry = PatternRegistry(maxsize=2)
+        first = registry.compile(r"\d+")
+        assert registry.compile(r"\d+") is first
+        registry.compile(r"\w+")
+        registry.compile(r"\s+")
+        assert registry.stats() == CacheStats(hits=1, misses=3, evictions=1, size=2, maxsize=2)
+        registry.compile(r"\d+")
+        assert registry.stats().misses == 4
+        registry.resize(1)
+        assert registry.stats().size == 1
+        assert registry.compile(b"\\d+").pattern == b"\\d+"
+        registry.clear()
+        assert registry.stats() == CacheStats(hits=0, misses=0, evictions=0, size=0, maxsize=1)
+
+        pattern = Pattern(r"\d\d\%")
+        assert Pattern(r"\d\d\%").compiled is pattern.compiled
+        unpickled = pickle.loads(pickle.dumps(pattern))
+        assert unpickled.compiled is pattern.compiled
+        assert unpickled("39%")
+
+    def test_profile_threads(self):
+        import threading
+        validation = {"age": [Range(0, 120)]}
+        entered = threading.Event()
+        first_done = threading.Event()
+        reports = {}
+
+        def first():
+            with profile() as report:
+                entered.wait()
+            reports["first"] = report
+            first_done.set()
+
+        def second():
+            with profile() as report:
+                entered.set()
+                first_done.wait()
+                validate(validation, {"age": 5})
+            reports["second"] = report
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert reports["first"].entries() == []
+        assert [entry.calls for entry in reports["second"].entries()] == [1]
+        assert validator._current_profiler() is None
+        validate(validation, {"age": 5})
+        assert [entry.calls for entry in reports["second"].entries()] == [1]
+
+    def test_profile(self):
+        validation = {
+            "age": [Required, Range(0, 120)],
+            "name": [Length(1)],
+            "codes": [Contains(3)],
+            "tags": [Each({"label": [Required, Truthy()]})],
+        }
+        document = {"age": 200, "name": 5, "codes": 5, "tags": [{"label": "a"}, {"label": ""}]}
+        with profile() as report:
+            result = validate(validation, document)
+            assert compile(validation).validate(document) == result
+        assert result == validate(validation, document)
+        assert validator._current_profiler() is None
+
+        entries = dict(((e.path, e.validator), e) for e in report.entries())
+        assert entries[(("age",), "Range")].calls == 2
+        assert entries[(("age",), "Range")].failures == 2
+        assert entries[(("age",), "Required")].failures == 0
+        assert entries[(("name",), "Length")].failures == 2
+        assert entries[(("name",), "Length")].exceptions == 0
+        assert entries[(("codes",), "Contains")].exceptions == 2
+        assert entries[(("tags", "*", "label"), "Truthy")].calls == 4
+        assert entries[(("tags", "*", "label"), "Truthy")].failures == 2
+        assert entries[(("tags",), "Each")].failures == 2
+        times = [e.time for e in report.sorted("time")]
+        assert times == sorted(times, reverse=True)
+
+    def test_type_guards(self):
+        calls = []
+
+        class Lowercase(Validator):
+            accepts = str
+            err_message = "must be lowercase"
+
+            def __call__(self, value):
+                calls.append(value)
+                return value.islower()
+
+        validation = {
+            "name": [Lowercase()],
+            "size": [Length(2)],
+            "code": [Not(Pattern(r"\d+"))],
+            "email": [Email()],
+            "items": [Each([Truthy()])],
+        }
+        dictionary = {"name": 5, "size": None, "code": 12, "email": [], "items": 3}
+        errors = {
+            "name": ["must be lowercase"],
+            "size": [Length(2).err_message],
+            "code": ["must not match regex pattern \\d+"],
+            "email": ["must be a valid email"],
+            "items": ["failed validation"],
+        }
+        for backend in ("plan", "codegen"):
+            schema = compile(validation, backend)
+            assert schema.validate(dictionary) == ValidationResult(valid=False, errors=errors)
+            assert not schema.is_valid(dictionary)
+        assert validate(validation, dictionary) == ValidationResult(valid=False, errors=errors)
+        assert not is_valid(validation, dictionary)
+        assert calls == []
+        assert validate(validation, {"name": "spam"}).valid
+        assert calls == ["spam"]
+
+    def test_slots_and_memory_report(self):
+        validators = [In([1, 2]), Not(Blank()), Range(0, 9), GreaterThan(0), LessThan(9),
+                      Equals(1), Blank(), Truthy(), InstanceOf(int), SubclassOf(int),
+                      Pattern(r"\d+"), Url(), If(Equals(1), Then({})), Then({}),
+                      Or(Blank()), And(Blank()), Length(1), Contains(1), Each([Blank()]),
+                      Email(), ArgSpec("a")]
+        for v in validators:
+            assert not hasattr(v, "__dict__"), v
+            copy = pickle.loads(pickle.dumps(v))
+            assert getattr(copy, "err_message", None) == getattr(v, "err_message", None)
+
+        custom = Or(Blank())
+        custom.err_message = "must be blank"
+        assert pickle.loads(pickle.dumps(custom)).err_message == "must be blank"
+
+        length = Length(1, 255)
+        one = memory_report({"a": [length]})
+        two = memory_report({"a": [length], "b": [length]})
+        assert one.size > 0 and one.size == sum(one.by_type.values())
+        assert one.by_type["Length"] == two.by_type["Length"]
+        assert two.objects == one.objects + 2
+        cyclic = {}
+        cyclic["self"] = [cyclic]
+        assert memory_report(cyclic).objects == 3
+
+    def test_interning(self):
+        intern_registry.clear()
+        with interning():
+            length = Length(1, 255)
+            assert Length(1, 255) is length
+            assert Length(1, maximum=255) is not length
+            assert Equals(1) is not Equals(True)
+            assert In(["a", "b"]) is In(["a", "b"])
+            assert In(["a", "b"]) is not In(("a", "b"))
+            assert Not(Length(1, 255)) is Not(Length(1, 255))
+            assert Then({}) is not Then({})
+            assert Equals(bytearray(b"x")) is not Equals(bytearray(b"x"))
+        assert Length(1, 255) is not length
+        assert intern_registry.stats().hits == 6
+        assert len(set([length, length])) == 1
+
+        def build():
+            return dict(("field%d" % i, [Length(1, 255), InstanceOf(str)]) for i in range(100))
+        plain = memory_report(build())
+        with interning():
+            shared = memory_report(build())
+        assert shared.size < plain.size
+        assert shared.by_type["Length"] == plain.by_type["Length"] / 100
+        assert validate(build(), {"field1": ""}) == (False, {"field1": [Length(1, 255).err_message]})
+        intern_registry.clear()
+
+    def test_interning_threads(self):
+        import threading
+        entered = threading.Event()
+        first_done = threading.Event()
+        created = {}
+
+        def first():
+            with interning():
+                entered.wait()
+            first_done.set()
+
+        def second():
+            with interning():
+                entered.set()
+                first_done.wait()
+                created["inside"] = (Equals(1), Equals(1))
+            created["after"] = (Equals(1), Equals(1))
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        inside, after = created["inside"], created["after"]
+        assert inside[0] is inside[1]
+        assert after[0] is not after[1]
+        assert Equals(1) is not Equals(1)
+        intern_registry.clear()
+
+    def test_validator_metaclass(self):
+        from abc import ABCMeta
+
+        def call(self, value):
+            return value == 1
+        Custom = ABCMeta("Custom", (Validator,), {"__call__": call})
+        assert validate({"foo": [Custom()]}, {"foo": 2}) == (False, {"foo": ["failed validation"]})
+        assert isinstance(ABCMeta("Incomplete", (Validator,), {})(), Validator)
+        with interning():
+            assert Equals(1) is Equals(1)
+            assert isinstance(Custom(), Custom)
+            with pytest.raises(TypeError):
+                Range()
+            equals = pickle.loads(pickle.dumps(Equals(2)))
+            assert equals.obj == 2 and equals is not Equals(2)
+            assert pickle.loads(pickle.dumps(Range(1, 2))).end == 2
+        intern_registry.clear()
+
+    def test_cached_validator(self):
+        calls = []
+
+        def expensive(value):
+            calls.append(value)
+            return value > 0
+
+        cached = Cached(expensive, maxsize=2)
+        assert [cached(1), cached(1), cached(True), cached(-1), cached(1)] == [True, True, True, False, True]
+        assert calls == [1, True, -1, 1]
+        assert cached.stats() == CacheStats(hits=1, misses=4, evictions=2, size=2, maxsize=2)
+        lengthy = Cached(Length(2))
+        assert lengthy([1, 2]) and lengthy.stats().misses == 0
+        cached.clear()
+        assert cached.stats().size == 0
+
+        email = Cached(Email())
+        validation = {"from": [email]}
+        assert validate(validation, {"from": "someone@example.com"}).valid
+        assert validate(validation, {"from": 5}) == (False, {"from": ["must be a valid email"]})
+        assert validate(validation, {"from": "someone@example.com"}).valid
+        assert email.stats().hits == 1
+        assert Not(Cached(Blank())).err_message == "must not be an empty string"
+        assert pickle.loads(pickle.dumps(email)).stats().size == 0
+        with pytest.raises(ValueError):
+            Cached(If(Equals(1), Then({})))
+
+    def test_argspec_signatures(self):
+        import validator.ext
+
+        # keyword-only arguments are a syntax error on python 2
+        namespace = {}
+        exec("def keyword_only(a, b=1, *args, c, d=2, **kwargs): pass", namespace)
+        exec("def positional(a, c, b=1, d=2): pass", namespace)
+        keyword_only = namespace.pop("keyword_only")
+
+        class Handler(object):
+            def handle(self, event, retries=3):
+                pass
+
+        validation = {
+            "kwonly": [ArgSpec("a", "*", "c", b=1, d=2)],
+            "method": [ArgSpec("self", "event", retries=3)],
+            "wrong": [Not(ArgSpec("a", "b", "c", d=2))],
+            "positional": [Not(ArgSpec("a", "*", "c", b=1, d=2)), ArgSpec("a", "c", b=1, d=2)],
+            "not_positional": [Not(ArgSpec("a", "c", b=1, d=2))],
+            "builtin": [Not(ArgSpec("a"))],
+        }
+        values = {"kwonly": keyword_only, "method": Handler().handle, "wrong": keyword_only,
+                  "positional": namespace["positional"], "not_positional": keyword_only, "builtin": len}
+        assert validate(validation, values).valid
+        assert keyword_only in validator.ext._argspecs
+        assert validate(validation, values).valid
+
+        spec = pickle.loads(pickle.dumps(ArgSpec("a", "*", "c", b=1, d=2)))
+        assert spec(keyword_only)
+        import gc
+        gc.collect()
+        count = len(validator.ext._argspecs)
+        del keyword_only, values
+        gc.collect()
+        assert len(validator.ext._argspecs) < count
+
+    def test_revalidate(self):
+        calls = []
+
+        def tracked(value):
+            calls.append(value)
+            return True
+
+        validation = {
+            "name": [Required, Length(1), tracked],
+            "type": [If(Equals("business"), Then({"vat": [Required, Pattern(r"\d+")]}))],
+            "vat": [tracked],
+            "age": [Range(0, 120)],
+        }
+        schema = compile(validation)
+        document = {"name": "spam", "type": "business", "vat": "x", "age": 200}
+        result = validate(schema, document)
+        assert result.errors["type"] and result.errors["age"]
+
+        del calls[:]
+        document["age"] = 30
+        result = revalidate(result, schema, document, ["age"])
+        assert calls == []
+        assert result == validate(validation, document)
+
+        del calls[:]
+        document["vat"] = "123"
+        result = revalidate(result, schema, document, ["vat"])
+        assert result == (True, {})
+        assert calls == ["123"]
+
+        del document["name"]
+        result = revalidate(result, validation, document, ["name"])
+        assert result == (False, {"name": ["must be present"]})
+
+    def test_optimize(self):
+        truthy, length, blank = Truthy(), Length(1), Blank()
+        validation = {
+            "bounded": [GreaterThan(0), LessThan(10, inclusive=True), Range(-5, 8), Truthy()],
+            "double": [Not(Not(Range(0, 3)))],
+            "nested": [And(And(truthy, length), length)],
+            "either": [Or(blank, Or(Equals("x"), blank))],
+            "single": [In(["x"])],
+            "child": [{"value": [GreaterThan(1), LessThan(5)]}],
+            "items": [Each({"value": [Not(Not(Truthy()))]})],
+        }
+        optimized = optimize(validation)
+        assert validation["double"][0].validator.validator.start == 0
+        bounded = optimized["bounded"]
+        assert [type(v) for v in bounded] == [validator._Interval, Truthy]
+        assert (bounded[0].lower, bounded[0].upper, bounded[0].upper_inclusive) == (0, 8, True)
+        assert type(optimized["double"][0]) is Range
+        assert optimized["nested"][0].validators == (truthy, length)
+        assert len(optimized["either"][0].validators) == 2
+        assert type(optimized["single"][0]) is Equals
+        assert type(optimized["child"][0]["value"][0]) is validator._Interval
+        assert type(optimized["items"][0].validations["value"][0]) is Truthy
+
+        documents = [
+            {"bounded": 5, "double": 1, "nested": "a", "either": "", "single": "x",
+             "child": {"value": 3}, "items": [{"value": 1}]},
+            {"bounded": 9, "double": 5, "nested": 1, "either": "y", "single": "y",
+             "child": {"value": 7}, "items": [{"value": 0}]},
+            {"bounded": "a", "double": None, "nested": "", "either": 0, "single": ["x"],
+             "child": {"value": 1.0}, "items": [{}]},
+            {"bounded": float("nan"), "child": {"value": 4.5}},
+        ]
+        for document in documents:
+            assert validate(optimized, document) == validate(validation, document)
+            assert compile(optimized).validate(document) == validate(validation, document)
+        assert validate(optimized, {"bounded": 9})[1] == {"bounded": ["must fall between -5 and 8"]}
+
+        cyclic = {"value": [Range(0, 5), Range(1, 6)]}
+        cyclic["child"] = [cyclic]
+        optimized = optimize(cyclic)
+        assert optimized["child"][0] is optimized
+
+    def test_optimize_one_of(self):
+        pets = OneOf("type", {
+            "cat": {"lives": [Not(Not(Range(0, 9)))]},
+            "dog": compile({"good": [Equals(True)]}),
+        })
+        pets.unknown_message = "must be a pet"
+        validation = {"k": [If(Equals("pet"), Then(pets))]}
+        documents = [
+            {"type": "cat", "lives": 10}, {"type": "cat", "lives": 3},
+            {"type": "dog", "good": False}, {"type": "fish"}, {},
+        ]
+        optimized = optimize(pets)
+        assert type(optimized) is OneOf and optimized is not pets
+        assert type(optimized.schemas["cat"]["lives"][0]) is Range
+        assert optimized.schemas["dog"] is pets.schemas["dog"]
+        for document in documents:
+            assert validate(optimized, document) == validate(pets, document)
+        optimized = optimize(validation)
+        assert type(optimized["k"][0].then_clause.validation) is OneOf
+        for document in documents:
+            document = dict(document, k="pet")
+            assert validate(optimized, document) == validate(validation, document)
+            assert validate(optimize({"v": [pets]}), {"v": document}) == validate({"v": [pets]}, {"v": document})
+        assert validate(optimize({"k": [Each(pets)]}), {"k": documents}) == \
+            validate({"k": [Each(pets)]}, {"k": documents})
+
+    def test_optimize_shared_and_lazy_messages(self):
+        with interning():
+            validation = {"a": [In(["x"])], "b": [Equals("x")]}
+            optimized = optimize(validation)
+        assert optimized["a"][0].err_message == "must be one of ['x']"
+        assert validation["b"][0].err_message == "must be equal to 'x'"
+        assert validate(optimized, {"a": "y", "b": "y"}).errors == {
+            "a": ["must be one of ['x']"], "b": ["must be equal to 'x'"]}
+
+        allowlist = In(list(range(100000)))
+        either = Or(Or(allowlist, Blank()), Equals(-1))
+        flattened = optimize({"a": [either]})["a"][0]
+        assert len(flattened.validators) == 3
+        for v in (either, either.validators[0], allowlist, flattened):
+            assert not validator._built_message(v, "err_message")
+        assert flattened.err_message == either.err_message
+        assert flattened.not_message == either.not_message
+
+    def test_adaptive_or_and(self):
+        calls = []
+
+        def expensive(value):
+            calls.append(value)
+            sum(range(1000))
+            return value == "http://example.com"
+        # so that it can be skipped, as it can't raise
+        expensive.accepts = str
+
+        either = Or(expensive, Blank(), adaptive=True)
+        both = And(expensive, Not(Blank()), adaptive=True)
+        values = [""] * 9 + ["http://example.com"]
+        for _ in range(validator._AdaptiveOrder.REORDER_EVERY // len(values) + 1):
+            for value in values:
+                assert either(value) == Or(expensive, Blank())(value)
+                assert both(value) == And(expensive, Not(Blank()))(value)
+        assert either.adaptive.ordering == ((1, 0), (1, 0))
+        assert both.adaptive.ordering[0] == (1, 0)
+        assert Or(Url(), Blank(), adaptive=True).err_message == Or(Url(), Blank()).err_message
+
+        del calls[:]
+        assert either("") and not both("")
+        assert calls == []
+
+        with pytest.raises(TypeError):
+            Or(Blank(), adaptiv=True)
+        with pytest.raises(TypeError):
+            Or(Blank(), Length(1), adaptive=True)(5)
+        # a child that raises decides things in the given order,
+        # however the children have been reordered
+        digits = Or(Pattern(r"\d+"), Equals(5), adaptive=True)
+        plain = Or(Pattern(r"\d+"), Equals(5))
+        values = [5] * 9 + ["12"]
+        for _ in range(validator._AdaptiveOrder.REORDER_EVERY // len(values) + 1):
+            for value in values:
+                assert validate({"f": [digits]}, {"f": value}) == validate({"f": [plain]}, {"f": value})
+        assert digits.adaptive.ordering[0] == (1, 0)
+        assert not validate({"f": [digits]}, {"f": 5}).valid
+        typed = Or(Length(2), Equals("x"), adaptive=True)
+        typed.adaptive.ordering = ((1, 0), (1, 0))
+        assert typed("x")
+        with pytest.raises(TypeError):
+            typed(5)
+
+        # validators without `accepts` can't be skipped, so nothing
+        # given after one is ever tried before it
+        assert Or(Equals(1), Equals(2), adaptive=True).adaptive is None
+        calls = []
+
+        def counted(value):
+            calls.append(value)
+            return value == 2
+        runs = Or(Length(3), Equals("x"), counted, Length(1), Blank(), adaptive=True)
+        assert runs.adaptive.runs == [(0, 2), (2, 3), (3, 5)]
+        for _ in range(validator._AdaptiveOrder.REORDER_EVERY):
+            assert runs("x")
+        assert runs.adaptive.ordering[0][:3] == (1, 0, 2)
+        # only the sampled calls got as far as `counted`
+        assert len(calls) == runs.adaptive.samples
+
+        state = pickle.loads(pickle.dumps(either.adaptive))
+        assert state.ordering[0] == (1, 0) and state.samples == either.adaptive.samples
+        assert compile({"foo": [either]}, backend="codegen").validate({"foo": "x"}) == validate({"foo": [either]}, {"foo": "x"})
+
+    def test_each_stream(self):
+        validation = {"values": [Each([Range(0, 10)], stream=True, max_errors=2)]}
+        result = validate(validation, {"values": (i * 5 for i in range(1000))})
+        assert result.errors == {"values": [
+            "all values must fall between 0 and 10",
+            "all values must fall between 0 and 10",
+            {"failed": 997},
+        ]}
+        assert compile(validation).validate({"values": iter(range(20))}) == \
+            validate(validation, {"values": iter(range(20))})
+        assert compile(validation).is_valid({"values": iter(range(5))})
+        assert not is_valid(validation, {"values": iter([1, 2, 30])})
+        assert validate(validation, {"values": [5, 50]}, fail_fast=True).errors == \
+            {"values": ["all values must fall between 0 and 10"]}
+
+        rows = {"rows": [Each({"id": [Required]}, stream=True)]}
+        assert rows["rows"][0].max_errors == 100
+        result = validate(rows, {"rows": ({} if i % 2 else {"id": i} for i in range(1001))})
+        assert len(result.errors["rows"]) == 1
+        assert len(result.errors["rows"][0]) == 101
+        assert result.errors["rows"][0]["failed"] == 500
+        assert result.errors["rows"][0][1] == {"id": ["must be present"]}
+
+        assert not is_valid({"values": [Each([Range(0, 10)])]}, {"values": iter(range(5))})
+        assert validate({"values": [Each([Range(0, 10)], max_errors=1)]}, {"values": [20, 30]}).errors == \
+            {"values": ["all values must fall between 0 and 10", {"failed": 2}]}
+        # nothing was dropped, so there's no total
+        assert validate({"values": [Each([Range(0, 10)], max_errors=2)]}, {"values": [20, 30]}).errors == \
+            {"values": ["all values must fall between 0 and 10"] * 2}
+        assert validate({"rows": [Each({"id": [Required]}, max_errors=1)]}, {"rows": [{}]}).errors == \
+            {"rows": [{0: {"id": ["must be present"]}}]}
+
+    def test_each_aggregate(self):
+        validation = {
+            "values": [Each([Range(0, 10)], aggregate=True)],
+            "rows": [Each({"id": [Required, Range(0, 10)], "child": [{"x": [Equals(1)]}]}, aggregate=True)],
+        }
+        rows = [{"id": i, "child": {"x": i % 2}} for i in range(20)] + [{}]
+        result = validate(validation, {"values": list(range(100)), "rows": rows})
+        assert result.errors == {
+            "values": [{"message": "all values must fall between 0 and 10", "count": 89, "indices": list(range(11, 21))}],
+            "rows": [{
+                "id": [
+                    {"message": "must fall between 0 and 10", "count": 9, "indices": list(range(11, 20))},
+                    {"message": "must be present", "count": 1, "indices": [20]},
+                ],
+                "child": [{"message": {"x": ["must be equal to 1"]}, "count": 10, "indices": list(range(0, 20, 2))}],
+            }],
+        }
+        for backend in ("plan", "codegen"):
+            schema = compile(validation, backend=backend)
+            assert schema.validate({"values": list(range(100)), "rows": rows}) == result
+            assert schema.validate({"values": [50, 60]}, fail_fast=True).errors == \
+                {"values": [{"message": "all values must fall between 0 and 10", "count": 1, "indices": [0]}]}
+        assert validate(validation, {"values": [1], "rows": []}).errors == {}
+
+        # a value failing two validators with the same message counts once
+        same = Each([Range(0, 10), Range(0, 10)], aggregate=True)
+        assert same([1, 20, 30]) == (False, [{"message": "all values must fall between 0 and 10", "count": 2, "indices": [1, 2]}])
+        assert Each([Truthy()], stream=True, aggregate=True)(iter([0, 1])) == \
+            (False, [{"message": "all values must be True-equivalent value", "count": 1, "indices": [0]}])
+
+    def test_one_of(self):
+        pets = OneOf("type", {
+            "cat": {"name": [Required, In(["whiskers", "fuzzy", "tiger"])]},
+            "dog": {"name": [Required, In(["spot", "ace", "bandit"])]},
+        })
+        cat = {"type": "cat", "name": "fuzzy"}
+        dog = {"type": "dog", "name": "fuzzy"}
+        dog_errors = {"name": ["must be one of ['spot', 'ace', 'bandit']"]}
+
+        assert validate(pets, cat) == (True, {})
+        assert validate(pets, dog) == (False, dog_errors)
+        assert validate(pets, {"type": "fish"}) == (False, {"type": ["must be one of ['cat', 'dog']"]})
+        assert validate(pets, {"type": ["cat"]}).errors == {"type": ["must be one of ['cat', 'dog']"]}
+        assert validate(pets, {"name": "spot"}) == (False, {"type": ["must be present"]})
+        assert is_valid(pets, cat) and not is_valid(pets, dog) and not is_valid(pets, {})
+        assert compile(pets) is pets
+
+        for backend in ("plan", "codegen"):
+            schema = compile({"pets": [Each(pets)], "pet": [pets]}, backend=backend)
+            assert schema.validate({"pets": [cat, dog, cat], "pet": cat}) == \
+                (False, {"pets": [{1: dog_errors}]})
+            assert schema.validate({"pets": [cat], "pet": dog}) == (False, {"pet": [dog_errors]})
+            assert schema.validate({"pets": [], "pet": 5}) == (False, {"pet": ["must be a dictionary"]})
+            assert not schema.is_valid({"pets": [cat, {}]})
+        assert validate({"pets": [Each(pets)]}, {"pets": [cat, dog]}) == (False, {"pets": [{1: dog_errors}]})
+        assert validate({"pets": [Each(pets, aggregate=True)]}, {"pets": [dog, dog]}).errors == \
+            {"pets": [{"name": [{"message": dog_errors["name"][0], "count": 2, "indices": [0, 1]}]}]}
+
+        # only the chosen validation is run
+        calls = []
+
+        def record(value):
+            calls.append(value)
+            return True
+        many = OneOf("kind", dict((i, {"value": [record]}) for i in range(100)))
+        assert many.is_valid({"kind": 42, "value": "x"})
+        assert calls == ["x"]
+
+        unpickled = pickle.loads(pickle.dumps(pets))
+        assert unpickled.validate(dog) == validate(pets, dog)
+
+        # inside a Then clause too, with every engine
+        conditional = {"kind": [If(Equals("pet"), Then(pets))]}
+        document = {"kind": "pet", "type": "dog", "name": "fuzzy"}
+        expected = validate(conditional, document)
+        assert expected == (False, {"kind": [dog_errors]})
+        for backend in ("plan", "codegen"):
+            schema = compile(conditional, backend=backend)
+            assert schema.validate(document) == expected
+            assert not schema.is_valid(document)
+            assert schema.validate(document, fail_fast=True) == expected
+        assert not is_valid(conditional, document)
+        assert validate_many(conditional, [document], summary=True).invalid == [0]
+        with profile():
+            assert validate(conditional, document) == expected
+        changed = dict(document, name="spot")
+        assert revalidate(expected, conditional, changed, ["name"]) == validate(conditional, changed)
+
+        with pytest.raises(ValueError):
+            revalidate(validate(pets, dog), pets, cat, ["name"])
+        with pytest.raises(ValueError):
+            compile(pets, key_order=KeyOrder())
+
+        # is_valid doesn't build errors for a OneOf key rule either
+        built = []
+
+        class Recording(OneOf):
+            __slots__ = ()
+
+            def _collect(self, dictionary, errors=None, fail_fast=False):
+                built.append(dictionary)
+                return super(Recording, self)._collect(dictionary, errors, fail_fast)
+        recording = Recording("type", pets.schemas)
+        for backend in ("plan", "codegen"):
+            assert not compile({"pet": [recording]}, backend=backend).is_valid({"pet": dog})
+        assert built == []
+        assert not validate({"pet": [recording]}, {"pet": dog}).valid
+        assert built == [dog]
+
+    def test_key_order(self):
+        def expensive(value):
+            sum(range(1000))
+            return True
+        expensive.err_message = "must be expensive"
+        expensive.not_message = "must not be expensive"
+
+        validation = {
+            "slow": [Required, expensive],
+            "rare": [Range(0, 10)],
+            "often": [Required, Equals(1)],
+        }
+        documents = [{"slow": 1, "rare": 5, "often": 2}] * 9 + [{"slow": 1, "rare": 50, "often": 1}]
+        for backend in ("plan", "codegen"):
+            schema = compile(validation, backend=backend, key_order=KeyOrder())
+            for _ in range(KeyOrder.REORDER_EVERY // len(documents)):
+                for document in documents:
+                    assert schema.validate(document, fail_fast=True).valid == validate(validation, document).valid
+                    assert schema.is_valid(document) == is_valid(validation, document)
+            assert schema.key_order.order == ("often", "rare")
+            assert schema.validate({"slow": 1, "rare": 50, "often": 2}, fail_fast=True).errors == {"often": ["must be equal to 1"]}
+            assert len(schema.validate({"rare": 50, "often": 2}).errors) == 3
+
+        loaded = KeyOrder.load(json.loads(json.dumps(schema.key_order.dump())))
+        assert loaded.order == schema.key_order.order
+        assert loaded.stats == schema.key_order.stats
+        assert pickle.loads(pickle.dumps(loaded)).order == loaded.order
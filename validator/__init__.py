@@ -31,17 +31,40 @@ Author: Samuel Lucidi <sam@samlucidi.com>
 __version__ = "1.3.0"
 
 import re
+import sys
+import string
+import bisect
+import numbers
+import itertools
+import threading
+import contextlib
+import types
 from collections import namedtuple
 from collections import defaultdict
+from collections import OrderedDict
 from abc import ABCMeta, abstractmethod
 try:
     # python 3
     from urllib.parse import urlparse
+    from collections.abc import Sized, Iterable
+    import builtins
+    import reprlib
 except ImportError:
     from urlparse import urlparse
+    from collections import Sized, Iterable
+    import __builtin__ as builtins
+    import repr as reprlib
+try:
+    from time import perf_counter as _timer
+except ImportError:
+    from time import time as _timer
 
 
 ValidationResult = namedtuple('ValidationResult', ['valid', 'errors'])
+BatchSummary = namedtuple('BatchSummary', ['invalid', 'error_counts'])
+CacheStats = namedtuple('CacheStats', ['hits', 'misses', 'evictions', 'size', 'maxsize'])
+MemoryReport = namedtuple('MemoryReport', ['size', 'objects', 'by_type'])
+ProfileEntry = namedtuple('ProfileEntry', ['path', 'validator', 'calls', 'time', 'failures', 'exceptions'])
 
 
 def _isstr(s):
@@ -56,18 +79,136 @@ def _isstr(s):
     except NameError:
         return isinstance(s, str)
 
+try:
+    _string_types = (basestring,)
+    _class_types = (type, types.ClassType)
+except NameError:
+    _string_types = (str,)
+    _class_types = (type,)
+
+# When set to a number, collections quoted in error messages
+# (e.g. by In and Equals) show at most that many elements.
+MESSAGE_ITEMS_LIMIT = None
+
+def _message_repr(obj):
+    if MESSAGE_ITEMS_LIMIT is None:
+        return repr(obj)
+    r = reprlib.Repr()
+    r.maxlist = r.maxtuple = r.maxset = r.maxfrozenset = r.maxdict = MESSAGE_ITEMS_LIMIT
+    r.maxdeque = r.maxarray = MESSAGE_ITEMS_LIMIT
+    r.maxlevel = r.maxstring = r.maxlong = r.maxother = sys.maxsize
+    return r.repr(obj)
+
+class _lazy_message(object):
+    """
+    Decorator for a method that builds an error
+    message, turning it into an attribute that is
+    only computed the first time it's read, and
+    can be assigned to like any other attribute.
+    The message is kept in a slot named after the
+    method with a leading underscore, which the
+    class must declare.
+
+    """
+
+    def __init__(self, method):
+        self.method = method
+        self.slot = "_" + method.__name__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        try:
+            message = getattr(obj, self.slot)
+        except AttributeError:
+            message = self.method(obj)
+        else:
+            if type(message) is not _DeferredMessage:
+                return message
+            message = _message(message.validator, message.name)
+        setattr(obj, self.slot, message)
+        return message
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
+
+class _DeferredMessage(object):
+    # Stands in for a lazy message that is to be copied
+    # from another validator once it's first read.
+    __slots__ = ("validator", "name")
+
+    def __init__(self, validator, name):
+        self.validator = validator
+        self.name = name
+
+def _built_message(validator, name):
+    # Whether the message is already there, rather than still
+    # to be built, or copied over, by a _lazy_message.
+    lazy = getattr(type(validator), name, None)
+    if not isinstance(lazy, _lazy_message):
+        return True
+    try:
+        return type(getattr(validator, lazy.slot)) is not _DeferredMessage
+    except AttributeError:
+        return False
+
+def _message(validator, name):
+    # The default is the one _store_errs uses for plain callables
+    # like lambdas, which don't have messages of their own.
+    return getattr(validator, name, "failed validation")
+
+def _freeze(obj):
+    # Returns a hashable key that's equal for equal arguments of the
+    # same types, so that e.g. Equals(1) and Equals(True) stay apart.
+    if isinstance(obj, (list, tuple)):
+        return (type(obj), tuple(_freeze(item) for item in obj))
+    if isinstance(obj, dict):
+        return (type(obj), frozenset((_freeze(k), _freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, (set, frozenset)):
+        return (type(obj), frozenset(_freeze(item) for item in obj))
+    hash(obj)
+    return (type(obj), obj)
+
 class Validator(object):
     """
     Abstract class that advanced
     validators can inherit from in order
     to set custom error messages and such.
 
+    Set `accepts` to a type or tuple of types
+    if the validator can only pass values of
+    those types. Any other value then fails
+    with err_message without the validator
+    being called, which is much cheaper than
+    letting it raise.
+
     """
 
     __metaclass__ = ABCMeta
+    __slots__ = ()
 
     err_message = "failed validation"
     not_message = "failed validation"
+    accepts = None
+
+    def __new__(cls, *args, **kwargs):
+        # Inside `interning`, hands out the built-in validator created
+        # earlier with the same arguments. Python then runs __init__
+        # on it again with those arguments, which leaves it as it was.
+        if not _interning or cls not in _INTERNABLE or not _is_interning():
+            return object.__new__(cls)
+        try:
+            key = (cls, _freeze(args), _freeze(kwargs))
+        except TypeError:
+            # something unhashable that we don't know how to freeze
+            return object.__new__(cls)
+        try:
+            return intern_registry.get(key, lambda key: _fresh(cls, *args, **kwargs))
+        except Exception:
+            # Bad arguments raise again from __init__ for the caller.
+            # Unpickling calls __new__ without the arguments, and
+            # __setstate__ fills the instance in afterwards instead.
+            return object.__new__(cls)
 
     @abstractmethod
     def __call__(self, *args, **kwargs):
@@ -81,6 +222,16 @@ class In(Validator):
     within the collection
     passed to this validator.
 
+    Lists and tuples are indexed when the
+    validator is created, so that checking a
+    value doesn't have to scan them: into a
+    frozenset if their elements are hashable,
+    or else into a sorted list that's searched
+    with bisect if they can be ordered. Pass
+    index="hash", "sorted" or "none" to choose
+    for yourself. The index isn't updated if
+    the collection is changed afterwards.
+
     # Example:
         validations = {
             "field": [In([1, 2, 3])]
@@ -90,14 +241,77 @@ class In(Validator):
 
     """
 
-    def __init__(self, collection):
+    __slots__ = ("collection", "index", "index_kind", "_err_message", "_not_message")
+
+    def __init__(self, collection, index="auto"):
         self.collection = collection
-        self.err_message = "must be one of %r" % collection
-        self.not_message = "must not be one of %r" % collection
+        if index not in ("auto", "hash", "sorted", "none"):
+            raise ValueError("In index must be one of 'auto', 'hash', 'sorted' or 'none'.")
+        if index == "auto":
+            index = _pick_index(collection)
+        if index == "hash":
+            self.index = frozenset(collection)
+        elif index == "sorted":
+            self.index = sorted(collection)
+        else:
+            self.index = collection
+        self.index_kind = index
 
     def __call__(self, value):
+        try:
+            if self.index_kind == "hash":
+                return value in self.index
+            if self.index_kind == "sorted":
+                i = bisect.bisect_left(self.index, value)
+                return i < len(self.index) and self.index[i] == value
+        except TypeError:
+            # an unhashable value, or one that can't be compared
+            # with the elements, might still be equal to one of them
+            pass
         return (value in self.collection)
 
+    @_lazy_message
+    def err_message(self):
+        return "must be one of %s" % _message_repr(self.collection)
+
+    @_lazy_message
+    def not_message(self):
+        return "must not be one of %s" % _message_repr(self.collection)
+
+def _pick_index(collection):
+    # Strings, sets, dicts, ranges and so on already have a
+    # better `in` than anything we could build.
+    if not isinstance(collection, (list, tuple)):
+        return "none"
+    try:
+        frozenset(collection)
+        return "hash"
+    except TypeError:
+        pass
+    # Lists are the usual unhashable elements, and their ordering
+    # agrees with their equality as long as everything in them is
+    # ordered that way too, which isn't the case for e.g. sets.
+    kinds = set()
+    if all(isinstance(element, list) and _ordered_leaves(element, kinds)
+           for element in collection) and len(kinds) <= 1:
+        return "sorted"
+    return "none"
+
+def _ordered_leaves(element, kinds):
+    # Whether every leaf of a (nested) list is a number, a string or
+    # bytes, and so totally ordered; adds which of those to `kinds`.
+    if isinstance(element, list):
+        return all(_ordered_leaves(item, kinds) for item in element)
+    if isinstance(element, numbers.Real) and element == element:
+        kinds.add("number")
+    elif _isstr(element):
+        kinds.add("text")
+    elif isinstance(element, bytes):
+        kinds.add("bytes")
+    else:
+        return False
+    return True
+
 class Not(Validator):
     """
     Use to negate the requirement
@@ -106,14 +320,24 @@ class Not(Validator):
 
     """
 
+    __slots__ = ("validator", "accepts", "_err_message", "_not_message")
+
     def __init__(self, validator):
         self.validator = validator
-        self.err_message = getattr(validator, "not_message", "failed validation")
-        self.not_message = getattr(validator, "err_message", "failed validation")
+        # a value the negated validator would raise on fails either way
+        self.accepts = getattr(validator, "accepts", None)
 
     def __call__(self, value):
         return not self.validator(value)
 
+    @_lazy_message
+    def err_message(self):
+        return _message(self.validator, "not_message")
+
+    @_lazy_message
+    def not_message(self):
+        return _message(self.validator, "err_message")
+
 class Range(Validator):
     """
     Use to specify that the value of the
@@ -132,6 +356,8 @@ class Range(Validator):
 
     """
 
+    __slots__ = ("start", "end", "inclusive", "err_message", "not_message")
+
     def __init__(self, start, end, inclusive=True):
         self.start = start
         self.end = end
@@ -163,6 +389,8 @@ class GreaterThan(Validator):
 
     """
 
+    __slots__ = ("lower_bound", "inclusive", "err_message", "not_message")
+
     def __init__(self, lower_bound, inclusive=False):
         self.lower_bound = lower_bound
         self.inclusive = inclusive
@@ -193,6 +421,8 @@ class LessThan(Validator):
 
     """
 
+    __slots__ = ("upper_bound", "inclusive", "err_message", "not_message")
+
     def __init__(self, upper_bound, inclusive=False):
         self.upper_bound = upper_bound
         self.inclusive = inclusive
@@ -222,14 +452,22 @@ class Equals(Validator):
 
     """
 
+    __slots__ = ("obj", "_err_message", "_not_message")
+
     def __init__(self, obj):
         self.obj = obj
-        self.err_message = "must be equal to %r" % obj
-        self.not_message = "must not be equal to %r" % obj
 
     def __call__(self, value):
         return value == self.obj
 
+    @_lazy_message
+    def err_message(self):
+        return "must be equal to %s" % _message_repr(self.obj)
+
+    @_lazy_message
+    def not_message(self):
+        return "must not be equal to %s" % _message_repr(self.obj)
+
 class Blank(Validator):
     """
     Use to specify that the
@@ -249,6 +487,8 @@ class Blank(Validator):
 
     """
 
+    __slots__ = ("err_message", "not_message")
+
     def __init__(self):
         self.err_message = "must be an empty string"
         self.not_message = "must not be an empty string"
@@ -274,6 +514,8 @@ class Truthy(Validator):
 
     """
 
+    __slots__ = ("err_message", "not_message")
+
     def __init__(self):
         self.err_message = "must be True-equivalent value"
         self.not_message = "must be False-equivalent value"
@@ -324,6 +566,8 @@ class InstanceOf(Validator):
 
     """
 
+    __slots__ = ("base_class", "err_message", "not_message")
+
     def __init__(self, base_class):
         self.base_class = base_class
         self.err_message = "must be an instance of %s or its subclasses" % base_class.__name__
@@ -348,6 +592,10 @@ class SubclassOf(Validator):
 
     """
 
+    __slots__ = ("base_class", "err_message", "not_message")
+
+    accepts = _class_types
+
     def __init__(self, base_class):
         self.base_class = base_class
         self.err_message = "must be a subclass of %s" % base_class.__name__
@@ -356,6 +604,92 @@ class SubclassOf(Validator):
     def __call__(self, class_):
         return issubclass(class_, self.base_class)
 
+class _LRUCache(object):
+    """
+    A thread-safe mapping that holds at most
+    `maxsize` items (or any number, if maxsize
+    is None), evicting the least recently used
+    item to make room, and counting hits, misses
+    and evictions.
+
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        # Returns the item stored under `key`, first storing
+        # compute(key) under it if there isn't one.
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data[key] = value
+                return value
+        # computed outside the lock, so a slow compute doesn't
+        # hold up everyone else; if two threads race, one wins.
+        value = compute(key)
+        with self._lock:
+            self._data[key] = value
+            self._evict()
+        return value
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.evictions, len(self._data), self.maxsize)
+
+    def _evict(self):
+        while self.maxsize is not None and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+class PatternRegistry(_LRUCache):
+    """
+    Process-wide store of compiled regular
+    expressions that Pattern validators share,
+    so that every distinct pattern is compiled
+    once no matter how many validators use it.
+    Use the `pattern_registry` instance rather
+    than creating another one.
+
+    # Example:
+        pattern_registry.resize(10000)
+        pattern_registry.stats()
+        # CacheStats(hits=..., misses=..., evictions=..., size=..., maxsize=10000)
+
+    """
+
+    def compile(self, pattern, flags=0):
+        """
+        Return the compiled form of pattern, compiling
+        it only if it isn't already in the registry.
+
+        """
+
+        return self.get((type(pattern), pattern, flags), _compile_pattern)
+
+def _compile_pattern(key):
+    _, pattern, flags = key
+    return re.compile(pattern, flags)
+
+pattern_registry = PatternRegistry(maxsize=4096)
+
 class Pattern(Validator):
     r"""
     Use to specify that the
@@ -364,6 +698,9 @@ class Pattern(Validator):
     pattern provided to the
     validator.
 
+    Compiled patterns are shared between
+    validators through `pattern_registry`.
+
     # Example:
         validations = {
             "field": [Pattern('\d\d\%')]
@@ -373,15 +710,31 @@ class Pattern(Validator):
 
     """
 
+    __slots__ = ("pattern", "compiled", "accepts", "err_message", "not_message")
+
     def __init__(self, pattern):
         self.pattern = pattern
         self.err_message = "must match regex pattern %s" % pattern
         self.not_message = "must not match regex pattern %s" % pattern
-        self.compiled = re.compile(pattern)
+        self.compiled = pattern_registry.compile(pattern)
+        # bytes patterns also match anything supporting the buffer
+        # protocol, so only text patterns are guarded.
+        if _isstr(pattern) and not isinstance(pattern, bytes):
+            self.accepts = _string_types
+        else:
+            self.accepts = None
 
     def __call__(self, value):
         return self.compiled.match(value)
 
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__ if name != "compiled")
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.compiled = pattern_registry.compile(self.pattern)
+
 class Url(Validator):
     """
     Use to specify that the
@@ -397,6 +750,10 @@ class Url(Validator):
 
     """
 
+    __slots__ = ("err_message", "not_message")
+
+    accepts = _string_types + (bytes, bytearray)
+
     def __init__(self):
         self.err_message = "must be a valid URL"
         self.not_message = "must not be a valid URL"
@@ -425,6 +782,8 @@ class Then(Validator):
         fails = {"foo": 1, "bar": 3}
     """
 
+    __slots__ = ("validation",)
+
     def __init__(self, validation):
         self.validation = validation
 
@@ -448,6 +807,8 @@ class If(Validator):
         fails = {"foo": 1, "bar": 3}
     """
 
+    __slots__ = ("validator", "then_clause")
+
     def __init__(self, validator, then_clause):
         self.validator = validator
         self.then_clause = then_clause
@@ -464,6 +825,13 @@ class Or(Validator):
     """
     For Or logic verification
 
+    Pass adaptive=True to have it learn, from
+    a sample of the values it checks, which order
+    of its validators reaches a decision fastest,
+    and try them in that order. Results and error
+    messages stay the same, as long as none of the
+    validators raise exceptions.
+
     # Example:
         validations = {
             "foo": [Or(Equals(1), Blank())]
@@ -472,17 +840,29 @@ class Or(Validator):
         also_passes = {"foo":''}
         fails = {"foo":"x",}
     """
-    def __init__(self, *validators):
+
+    __slots__ = ("validators", "adaptive", "_err_message", "_not_message")
+
+    def __init__(self, *validators, **options):
         self.validators = validators
-        self.err_message = "must validate in {0}".format([item.err_message for item in validators])
-        self.not_message = "must not validate in {0}".format([item.not_message  for item in validators])
+        self.adaptive = _adaptive_order(validators, options)
 
     def __call__(self, field):
+        if self.adaptive is not None:
+            return self.adaptive(self.validators, field, True)
         for validator in self.validators:
             if validator(field):
                 return True
         return False
 
+    @_lazy_message
+    def err_message(self):
+        return "must validate in {0}".format([_message(item, "err_message") for item in self.validators])
+
+    @_lazy_message
+    def not_message(self):
+        return "must not validate in {0}".format([_message(item, "not_message") for item in self.validators])
+
 class And(Validator):
     """
     For And logic verification
@@ -491,6 +871,9 @@ class And(Validator):
     multiple authentication conditions, 
     it is not supported in the Or validator.
 
+    Like Or, it takes adaptive=True to learn
+    the fastest order to try its validators in.
+
     # Example:
     validations = {
         "foo": [Or(And(Url(), Length(14)),Blank())]
@@ -500,18 +883,180 @@ class And(Validator):
     fails = {"foo":"x",}
     also_fails = {"foo":"http://github.com"}
     """
-    def __init__(self, *validators):
+
+    __slots__ = ("validators", "adaptive", "_err_message", "_not_message")
+
+    def __init__(self, *validators, **options):
         self.validators = validators
-        self.err_message = "must validate all {0}".format([item.err_message for item in validators])
-        self.not_message = "must not validate all {0}".format([item.not_message  for item in validators])
+        self.adaptive = _adaptive_order(validators, options)
 
     def __call__(self, field):
+        if self.adaptive is not None:
+            return self.adaptive(self.validators, field, False)
         for validator in self.validators:
             if not validator(field):
                 # self.err_message = validator.err_message
                 return False
         return True
 
+    @_lazy_message
+    def err_message(self):
+        return "must validate all {0}".format([_message(item, "err_message") for item in self.validators])
+
+    @_lazy_message
+    def not_message(self):
+        return "must not validate all {0}".format([_message(item, "not_message") for item in self.validators])
+
+def _adaptive_order(validators, options):
+    # Handles the keyword arguments of Or and And.
+    adaptive = options.pop("adaptive", False)
+    if options:
+        raise TypeError("unexpected keyword argument %r" % next(iter(options)))
+    if not adaptive:
+        return None
+    runs = _reorderable_runs(validators)
+    if all(stop - start == 1 for start, stop in runs):
+        # nothing can be tried any earlier, so there's nothing to learn
+        return None
+    return _AdaptiveOrder(runs)
+
+def _reorderable_runs(validators):
+    # Splits the validators into runs, as (start, stop) ranges, that
+    # can be tried in any order among themselves: only the last of a
+    # run may lack `accepts`, since a validator that doesn't declare
+    # it can't be skipped safely, so nothing given after it may be
+    # tried before it.
+    runs = []
+    start = 0
+    for i, v in enumerate(validators):
+        if getattr(v, "accepts", None) is None:
+            runs.append((start, i + 1))
+            start = i + 1
+    if start < len(validators):
+        runs.append((start, len(validators)))
+    return runs
+
+class _AdaptiveOrder(object):
+    """
+    Runs the validators of an adaptive Or or And
+    in the order that's expected to reach a
+    decision soonest. Every SAMPLE_EVERY-th call
+    runs all of them, timing each one and noting
+    whether it would have decided the result; the
+    order is worked out again from those samples
+    every REORDER_EVERY calls.
+
+    The result is always the one the given order
+    would have had: a decision is only taken
+    early when none of the validators given before
+    the deciding one that were skipped could have
+    raised, i.e. they declare `accepts` and the
+    value is one of those types. Validators are
+    only ever moved ahead of ones that declare
+    `accepts`, so that this usually holds.
+
+    """
+
+    SAMPLE_EVERY = 16
+    REORDER_EVERY = 1024
+
+    def __init__(self, runs):
+        count = runs[-1][1]
+        self.runs = runs
+        # The order to try the validators in and, by validator
+        # index, each one's place in it. They're replaced together,
+        # so that a call never sees the one without the other.
+        self.ordering = (tuple(range(count)), tuple(range(count)))
+        self.calls = 0
+        self.samples = 0
+        self.time = [0.0] * count
+        self.decided = [0] * count
+        self._lock = threading.Lock()
+
+    def __call__(self, validators, value, decision):
+        # `decision` is the result that settles things as soon as
+        # one validator gives it: True for Or, False for And.
+        self.calls += 1
+        if self.calls % self.SAMPLE_EVERY == 0:
+            return self._sample(validators, value, decision)
+        order, position = self.ordering
+        try:
+            for ran, i in enumerate(order):
+                if bool(validators[i](value)) is decision:
+                    if _skipped_safely(validators, value, position, i, ran):
+                        return decision
+                    break
+            else:
+                return not decision
+        except Exception:
+            pass
+        # which exception gets raised, if any, is up to the
+        # order the validators were given in
+        return _run_in_order(validators, value, decision)
+
+    def _sample(self, validators, value, decision):
+        outcomes = []
+        for v in validators:
+            start = _timer()
+            try:
+                outcome = bool(v(value))
+            except Exception as e:
+                outcome = e
+            outcomes.append((outcome, _timer() - start))
+        with self._lock:
+            for i, (outcome, elapsed) in enumerate(outcomes):
+                self.time[i] += elapsed
+                self.decided[i] += outcome is decision
+            self.samples += 1
+            if self.samples % (self.REORDER_EVERY // self.SAMPLE_EVERY) == 0:
+                self._reorder()
+        for outcome, _ in outcomes:
+            if isinstance(outcome, Exception):
+                raise outcome
+            if outcome is decision:
+                return decision
+        return not decision
+
+    def _reorder(self):
+        # Trying them by increasing cost per chance of deciding
+        # minimizes the expected cost of reaching a decision.
+        def rank(i):
+            if not self.decided[i]:
+                return (float("inf"), i)
+            return (self.time[i] / self.decided[i], i)
+        order = []
+        for start, stop in self.runs:
+            order.extend(sorted(range(start, stop), key=rank))
+        position = [0] * len(order)
+        for place, i in enumerate(order):
+            position[i] = place
+        self.ordering = (tuple(order), tuple(position))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+def _skipped_safely(validators, value, position, decided, ran):
+    # Whether none of the validators before the `decided` one
+    # that weren't among the first `ran` of the order can raise.
+    for i in range(decided):
+        if position[i] >= ran:
+            accepts = getattr(validators[i], "accepts", None)
+            if accepts is None or not isinstance(value, accepts):
+                return False
+    return True
+
+def _run_in_order(validators, value, decision):
+    for v in validators:
+        if bool(v(value)) is decision:
+            return decision
+    return not decision
+
 class Length(Validator):
     """
     Use to specify that the
@@ -533,12 +1078,16 @@ class Length(Validator):
 
     """
 
+    __slots__ = ("minimum", "maximum", "err_message", "not_message")
+
     err_messages = {
         "maximum": "must be at most {0} elements in length",
         "minimum": "must be at least {0} elements in length",
         "range": "must{0}be between {1} and {2} elements in length"
     }
 
+    accepts = Sized
+
     def __init__(self, minimum, maximum=0):
         if not minimum and not maximum:
             raise ValueError("Length must have a non-zero minimum or maximum parameter.")
@@ -579,14 +1128,22 @@ class Contains(Validator):
 
     """
 
+    __slots__ = ("contained", "_err_message", "_not_message")
+
     def __init__(self, contained):
         self.contained = contained
-        self.err_message = "must contain {0}".format(contained)
-        self.not_message = "must not contain {0}".format(contained)
 
     def __call__(self, container):
         return self.contained in container
 
+    @_lazy_message
+    def err_message(self):
+        return "must contain {0}".format(self.contained)
+
+    @_lazy_message
+    def not_message(self):
+        return "must not contain {0}".format(self.contained)
+
 class Each(Validator):
     """
     Each applies a set of validations to each
@@ -627,35 +1184,296 @@ class Each(Validator):
             })]
     }
 
+    With stream=True, Each accepts any iterable,
+    such as a generator or a database cursor, and
+    validates the elements as they are produced
+    without ever holding on to them.
+
+    Set max_errors to keep at most that many
+    errors, so memory use stays bounded however
+    many fail. If any had to be dropped, the
+    count of all the values that failed is added
+    under "failed": as a {"failed": count} dict
+    at the end of a list of errors, or as a key
+    of a dictionary of them. It defaults to 100
+    when streaming.
+
+    # Example
+        validation = {
+            "rows": [Each({"id": [Required]}, stream=True)]
+        }
+        validate(validation, {"rows": cursor})
+
+    A OneOf can be given instead of a dictionary,
+    to validate each element against whichever
+    validation its discriminator picks.
+
+    With aggregate=True, each distinct error is
+    reported just once, as a dict with the
+    "message", the "count" of values that failed
+    with it and the first MAX_INDICES of their
+    "indices". With a dictionary of validations,
+    these are listed under the key they're for.
+    max_errors isn't needed, and not used, then.
+
+    # Example
+        validation = {
+            "values": [Each([Range(0, 10)], aggregate=True)]
+        }
+        validate(validation, {"values": [5, 20, 30]})
+        # (False, {"values": [{"message": "all values must fall between 0 and 10",
+        #                      "count": 2, "indices": [1, 2]}]})
+
     """
 
-    def __init__(self, validations):
-        assert isinstance(validations, (list, tuple, set, dict))
+    __slots__ = ("validations", "stream", "max_errors", "aggregate", "accepts")
+
+    MAX_INDICES = 10
+
+    def __init__(self, validations, stream=False, max_errors=None, aggregate=False):
+        assert isinstance(validations, (list, tuple, set, dict, OneOf))
         self.validations = validations
+        self.stream = stream
+        if stream and max_errors is None:
+            max_errors = 100
+        self.max_errors = max_errors
+        self.aggregate = aggregate
+        self.accepts = Iterable if stream else (list, tuple, set)
 
     def __call__(self, container):
-        assert isinstance(container, (list, tuple, set))
+        return self._apply(container, None)
+
+    def _apply(self, container, schema, fail_fast=False):
+        # `schema` is the precompiled form of a dict of
+        # validations, handed in by CompiledSchema so that
+        # it doesn't get re-analyzed for every call.
+        # With fail_fast, stop at the first element that fails.
+        assert isinstance(container, self.accepts)
+        if self.aggregate:
+            return self._aggregate(container, schema, fail_fast)
+        max_errors = self.max_errors
+        failed = 0
+        dropped = False
 
         # handle the "apply simple validation to each in list"
         # use case
         if isinstance(self.validations, (list, tuple, set)):
             errors = []
             for item in container:
+                item_failed = False
                 for v in self.validations:
                     valid = v(item)
                     if not valid:
-                        errors.append("all values " + v.err_message)
+                        item_failed = True
+                        if max_errors is None or len(errors) < max_errors:
+                            errors.append("all values " + v.err_message)
+                        else:
+                            dropped = True
+                        if fail_fast:
+                            return (False, errors)
+                failed += item_failed
 
         # handle the somewhat messier list of dicts case
-        if isinstance(self.validations, dict):
-            errors = defaultdict(list)
+        if isinstance(self.validations, (dict, OneOf)):
+            if schema is None:
+                schema = compile(self.validations)
+            errors = {}
+            for index, item in enumerate(container):
+                err = schema._collect(item, None, fail_fast)
+                if err:
+                    failed += 1
+                    if max_errors is None or len(errors) < max_errors:
+                        errors[index] = dict(err)
+                    else:
+                        dropped = True
+                    if fail_fast:
+                        break
+
+        if dropped:
+            # so that how many failed isn't lost with the dropped errors
+            if isinstance(errors, dict):
+                errors["failed"] = failed
+            else:
+                errors.append({"failed": failed})
+        return (failed == 0, errors)
+
+    def _aggregate(self, container, schema, fail_fast):
+        # _apply for aggregate=True. Each distinct message is
+        # counted in a [message, count, indices, last index]
+        # list, so the message strings are only built once.
+        if isinstance(self.validations, (dict, OneOf)):
+            if schema is None:
+                schema = compile(self.validations)
+            by_key = OrderedDict()
             for index, item in enumerate(container):
-                valid, err = validate(self.validations, item)
-                if not valid:
-                    errors[index] = err
-            errors = dict(errors)
+                err = schema._collect(item, None, fail_fast)
+                for key, messages in err.items():
+                    aggregates = by_key.setdefault(key, OrderedDict())
+                    for message in messages:
+                        frozen = message if _isstr(message) else _freeze(message)
+                        aggregate = aggregates.get(frozen)
+                        if aggregate is None:
+                            aggregate = aggregates[frozen] = [message, 0, [], None]
+                        self._count(aggregate, index)
+                if err and fail_fast:
+                    break
+            errors = dict((key, _aggregated(aggregates)) for key, aggregates in by_key.items())
+            return (not errors, errors)
+
+        # [validator, its aggregate], which is looked up on the
+        # validator's first failure and then just counted into
+        found = [[v, None] for v in self.validations]
+        aggregates = OrderedDict()
+        max_indices = self.MAX_INDICES
+        for index, item in enumerate(container):
+            for entry in found:
+                if not entry[0](item):
+                    aggregate = entry[1]
+                    if aggregate is None:
+                        message = "all values " + entry[0].err_message
+                        aggregate = aggregates.get(message)
+                        if aggregate is None:
+                            aggregate = aggregates[message] = [message, 0, [], None]
+                        entry[1] = aggregate
+                    # self._count, inlined since this is the hot loop
+                    if aggregate[3] != index:
+                        aggregate[1] += 1
+                        aggregate[3] = index
+                        if len(aggregate[2]) < max_indices:
+                            aggregate[2].append(index)
+                    if fail_fast:
+                        return (False, _aggregated(aggregates))
+        return (not aggregates, _aggregated(aggregates))
+
+    def _count(self, aggregate, index):
+        # counts each failing value once, even if more than
+        # one of its errors has the same message
+        if aggregate[3] != index:
+            aggregate[1] += 1
+            aggregate[3] = index
+            if len(aggregate[2]) < self.MAX_INDICES:
+                aggregate[2].append(index)
+
+    def _check(self, container, schema):
+        # Same as _apply, but only says whether the container
+        # passes, without building any error messages.
+        assert isinstance(container, self.accepts)
+        if isinstance(self.validations, (dict, OneOf)):
+            if schema is None:
+                schema = compile(self.validations)
+            for item in container:
+                if not schema._check(item):
+                    return False
+            return True
+        for item in container:
+            for v in self.validations:
+                if not v(item):
+                    return False
+        return True
+
+
+def _aggregated(aggregates):
+    return [{"message": message, "count": count, "indices": indices}
+            for message, count, indices, _ in aggregates.values()]
+
+
+class OneOf(Validator):
+    """
+    OneOf validates a dictionary against one of
+    several validations, picked by the value of
+    its `discriminator` key. The validation is
+    looked up in `schemas` by that value, so only
+    it is ever run, however many there are. A
+    missing or unknown discriminator is reported
+    as an error for the discriminator key.
+
+    A OneOf can be passed to validate, is_valid,
+    compile and Each in place of a validation, or
+    used as a rule for a key whose value is a
+    dictionary, just like a nested validation.
+
+    # Example:
+        events = OneOf("type", {
+            "click": {"x": [Required], "y": [Required]},
+            "scroll": {"offset": [Required, GreaterThan(0)]}
+        })
+        validate(events, {"type": "scroll", "offset": 0})
+        # (False, {"offset": ["must be greater than 0"]})
+        validation = {"events": [Each(events)]}
+
+    """
+
+    __slots__ = ("discriminator", "schemas", "compiled", "unknown_message")
+
+    err_message = "must be a dictionary"
+    accepts = dict
+
+    def __init__(self, discriminator, schemas):
+        self.discriminator = discriminator
+        self.schemas = schemas
+        self.compiled = dict((value, compile(schema)) for value, schema in schemas.items())
+        self.unknown_message = "must be one of %s" % _message_repr(list(schemas))
+
+    def __call__(self, dictionary):
+        errors = self._collect(dictionary)
+        return (not errors, dict(errors))
+
+    def validate(self, dictionary, fail_fast=False):
+        """
+        See `validate`.
+
+        """
+
+        schema = self._pick(dictionary)
+        if schema is None:
+            return ValidationResult(valid=False, errors=dict(self._unknown(dictionary, None)))
+        return schema.validate(dictionary, fail_fast)
+
+    def is_valid(self, dictionary):
+        """
+        See `is_valid`.
+
+        """
+
+        schema = self._pick(dictionary)
+        return schema is not None and schema.is_valid(dictionary)
+
+    def _pick(self, dictionary):
+        # The compiled validation for the dictionary's
+        # discriminator, or None if it's missing or unknown.
+        try:
+            return self.compiled.get(dictionary[self.discriminator])
+        except (KeyError, TypeError):
+            return None
+
+    def _unknown(self, dictionary, errors):
+        if errors is None:
+            errors = defaultdict(list)
+        if self.discriminator in dictionary:
+            errors[self.discriminator].append(self.unknown_message)
+        else:
+            errors[self.discriminator] = ["must be present"]
+        return errors
+
+    # These let a OneOf stand in for a CompiledSchema
+    # inside Each, validate_batch and the like.
 
-        return (len(errors) == 0, errors)
+    def _collect(self, dictionary, errors=None, fail_fast=False):
+        schema = self._pick(dictionary)
+        if schema is None:
+            return self._unknown(dictionary, errors)
+        return schema._collect(dictionary, errors, fail_fast)
+
+    def _check(self, dictionary):
+        schema = self._pick(dictionary)
+        return schema is not None and schema._check(dictionary)
+
+    def __getstate__(self):
+        # the compiled validations are rebuilt when unpickled
+        return (self.discriminator, self.schemas)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
 
 
 class Email(Validator):
@@ -676,15 +1494,201 @@ class Email(Validator):
         }
     """
 
+    __slots__ = ("err_message", "not_message")
+
+    accepts = _string_types
+
     def __init__(self):
         self.err_message = "must be a valid email"
         self.not_message = "must not be a valid email"
 
     def __call__(self, email):
-        return re.compile(r"^[^.].+@([?)[a-zA-Z0-9-.])+.([a-zA-Z]{2,3}|[0-9]{1,3})(]?)$").match(email)
+        return _is_email(email)
+
+# Characters allowed in the domain part of an email address, and
+# the (length, characters) combinations allowed in its last label.
+_EMAIL_DOMAIN_CHARS = frozenset("?)[-." + string.ascii_letters + string.digits)
+_EMAIL_TLDS = (
+    (1, frozenset(string.digits)),
+    (2, frozenset(string.digits)),
+    (3, frozenset(string.digits)),
+    (2, frozenset(string.ascii_letters)),
+    (3, frozenset(string.ascii_letters)),
+)
+
+def _is_email(email):
+    # Accepts exactly the strings matched by the regex Email used to use,
+    #   ^[^.].+@([?)[a-zA-Z0-9-.])+.([a-zA-Z]{2,3}|[0-9]{1,3})(]?)$
+    # but in a single backwards pass per possible last label, so it's
+    # O(n) no matter what it's given. The '@' can't be one of the domain
+    # characters, so for each possible last label the domain has to be
+    # the run of domain characters that ends just before the one
+    # arbitrary character in front of the label, and the '@' has to be
+    # the character before that run.
+    if not _isstr(email):
+        raise TypeError("expected a string, not %s" % type(email).__name__)
+    # `$` also matches before a newline at the very end
+    if email.endswith("\n"):
+        email = email[:-1]
+    # `[^.]` matches a newline, but `.` doesn't
+    if not email or email[0] == "." or "\n" in email[1:]:
+        return False
+    end = len(email) - 1 if email.endswith("]") else len(email)
+    for length, chars in _EMAIL_TLDS:
+        start = end - length
+        if start < 1 or not all(c in chars for c in email[start:end]):
+            continue
+        i = start - 2
+        while i >= 0 and email[i] in _EMAIL_DOMAIN_CHARS:
+            i -= 1
+        # at least two characters before the '@', and one after it
+        if 2 <= i < start - 2 and email[i] == "@":
+            return True
+    return False
+
+class Cached(Validator):
+    """
+    Wraps a validator and remembers its result for
+    the most recent `maxsize` distinct values (or
+    all of them, if maxsize is None), so expensive
+    validators like Url, Email, Pattern or ArgSpec
+    only run once for a value that keeps coming
+    back. Values that can't be hashed are always
+    passed straight to the validator. The cache is
+    safe to share between threads; use stats() to
+    see how often it's hit.
+
+    Only use this for validators whose result
+    depends on nothing but the value.
+
+    # Example:
+        validations = {
+            "referrer": [Cached(Url(), maxsize=10000)]
+        }
+
+    """
+
+    __slots__ = ("validator", "cache", "accepts", "_err_message", "_not_message")
+
+    def __init__(self, validator, maxsize=1024):
+        if isinstance(validator, (If, Then, dict)):
+            raise ValueError("Cached can only wrap validators that take a single value.")
+        self.validator = validator
+        self.cache = _LRUCache(maxsize)
+        self.accepts = getattr(validator, "accepts", None)
+
+    def __call__(self, value):
+        try:
+            # 1 and True are equal, but might not be equally valid
+            key = (type(value), value)
+            hash(key)
+        except TypeError:
+            return self.validator(value)
+        return self.cache.get(key, self._compute)
+
+    def _compute(self, key):
+        return self.validator(key[1])
+
+    def stats(self):
+        """
+        Return the CacheStats of this validator's cache.
 
+        """
+
+        return self.cache.stats()
+
+    def clear(self):
+        """
+        Empty the cache and reset its stats.
+
+        """
+
+        self.cache.clear()
+
+    @_lazy_message
+    def err_message(self):
+        return _message(self.validator, "err_message")
+
+    @_lazy_message
+    def not_message(self):
+        return _message(self.validator, "not_message")
+
+    def __getstate__(self):
+        # the cache holds a lock, so start afresh after unpickling
+        return (self.validator, self.cache.maxsize)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+class InternRegistry(_LRUCache):
+    """
+    Process-wide store of the validators created
+    inside `interning` blocks, keyed on their type
+    and arguments. Use the `intern_registry`
+    instance rather than creating another one.
+
+    # Example:
+        intern_registry.stats()
+        # CacheStats(hits=..., misses=..., evictions=0, size=..., maxsize=None)
 
-def validate(validation, dictionary):
+    """
+
+intern_registry = InternRegistry(maxsize=None)
+
+# Whether validators are being interned right now, by thread, and
+# how many interning blocks are open in any thread, which is checked
+# first so that creating validators outside of them stays cheap.
+_interns = threading.local()
+_interning = 0
+_interning_lock = threading.Lock()
+
+def _is_interning():
+    return _interning and getattr(_interns, "active", False)
+
+# The validators that can be interned. Then, If and Each are left
+# out because the validations they hold may still be filled in
+# after they're created, e.g. to make a cycle.
+_INTERNABLE = frozenset([In, Not, Range, GreaterThan, LessThan, Equals, Blank, Truthy,
+                         InstanceOf, SubclassOf, Pattern, Url, Or, And, Length, Contains, Email])
+
+@contextlib.contextmanager
+def interning():
+    """
+    Share validators between everything created
+    inside the block: a built-in validator created
+    with the same arguments as one created earlier
+    (in this or any other interning block) is that
+    same object rather than a new one. Since they
+    are shared, interned validators are equal, and
+    hash the same, exactly when their types and
+    arguments are; they must not be modified, and
+    neither may their arguments.
+
+    The validators are kept in `intern_registry`
+    until it's cleared. Only the thread running
+    the block interns what it creates; other
+    threads are left alone.
+
+    # Example:
+        with interning():
+            assert Length(1, 255) is Length(1, 255)
+
+    """
+
+    global _interning
+    previous = getattr(_interns, "active", False)
+    _interns.active = True
+    with _interning_lock:
+        _interning += 1
+    try:
+        yield
+    finally:
+        _interns.active = previous
+        with _interning_lock:
+            _interning -= 1
+
+
+def validate(validation, dictionary, fail_fast=False):
     """
     Validate that a dictionary passes a set of
     key-based validators. If all of the keys
@@ -692,18 +1696,30 @@ def validate(validation, dictionary):
     specified by the validation mapping, then
     the validation passes.
 
-    :param validation: a mapping of keys to validators
+    With fail_fast, validation stops at the first
+    validator that fails, including inside nested
+    validations, Each and If(Then()), so that only
+    that first error is reported.
+
+    :param validation: a mapping of keys to validators,
+    a CompiledSchema produced by `compile` or a OneOf
     :type validation: dict
 
     :param dictionary: dictionary to be validated
     :type dictionary: dict
 
+    :param fail_fast: stop at the first failure
+    :type fail_fast: bool
+
     :return: a tuple containing a bool indicating
     success or failure and a mapping of fields
     to error messages.
 
     """
 
+    if fail_fast or _current_profiler() is not None or isinstance(validation, (CompiledSchema, OneOf)):
+        return compile(validation).validate(dictionary, fail_fast)
+
     errors = defaultdict(list)
     for key in validation:
         if isinstance(validation[key], (list, tuple)):
@@ -735,13 +1751,32 @@ def _validate_and_store_errs(validator, dictionary, key, errors):
     # It's not ideal to have to hide exceptions like this because
     # there could be actual problems with a validator, but we're just going
     # to have to rely on tests preventing broken things.
+    # Built-in validators declare the types they accept, so
+    # the usual mismatches fail here without raising at all.
+    accepts = getattr(validator, "accepts", None)
     try:
-        valid = validator(dictionary[key])
+        value = dictionary[key]
+        if accepts is not None and not isinstance(value, accepts):
+            valid = (False, validator.err_message)
+        else:
+            valid = validator(value)
     except Exception:
         # Since we caught an exception while trying to validate,
         # treat it as a failure and return the normal error message
         # for that validator.
         valid = (False, validator.err_message)
+    # the same as _store_errs, written out as this runs for every
+    # validator that validate() calls
+    if isinstance(valid, tuple):
+        valid, errs = valid
+        if errs and isinstance(errs, list):
+            errors[key] += errs
+        elif errs:
+            errors[key].append(errs)
+    elif not valid:
+        errors[key].append(getattr(validator, "err_message", "failed validation"))
+
+def _store_errs(validator, valid, key, errors):
     if isinstance(valid, tuple):
         valid, errs = valid
         if errs and isinstance(errs, list):
@@ -751,7 +1786,7 @@ def _validate_and_store_errs(validator, dictionary, key, errors):
     elif not valid:
         # set a default error message for things like lambdas
         # and other callables that won't have an err_message set.
-        msg = getattr(validator, "err_message", "failed validation")
+        msg = _message(validator, "err_message")
         errors[key].append(msg)
 
 def _validate_list_helper(validation, dictionary, key, errors):
@@ -782,4 +1817,1392 @@ def _validate_list_helper(validation, dictionary, key, errors):
                         errors[key].append(dependent[1])
                 # handling for normal validators
                 else:
-                    _validate_and_store_errs(v, dictionary, key, errors)
\ No newline at end of file
+                    _validate_and_store_errs(v, dictionary, key, errors)
+
+def validate_many(validation, iterable, summary=False):
+    """
+    Validate every dictionary in an iterable against
+    the same validation, analyzing the validation only
+    once for the whole batch.
+
+    :param validation: a mapping of keys to validators,
+    a CompiledSchema produced by `compile` or a OneOf
+    :type validation: dict
+
+    :param iterable: the dictionaries to be validated
+    :type iterable: any iterable of dicts
+
+    :param summary: if true, only summarize the failures
+    :type summary: bool
+
+    :return: by default, a generator of (index, ValidationResult)
+    tuples, which validates each dictionary as it is consumed.
+    With summary=True, a BatchSummary holding the list of indices
+    of the invalid dictionaries and a mapping of each key to the
+    number of dictionaries that failed on it.
+
+    """
+
+    schema = compile(validation)
+    if not summary:
+        return _validate_each(schema, iterable)
+    invalid = []
+    error_counts = defaultdict(int)
+    errors = defaultdict(list)
+    for index, dictionary in enumerate(iterable):
+        schema._collect(dictionary, errors)
+        if errors:
+            invalid.append(index)
+            for key in errors:
+                error_counts[key] += 1
+            errors.clear()
+    return BatchSummary(invalid=invalid, error_counts=dict(error_counts))
+
+def _validate_each(schema, iterable):
+    for index, dictionary in enumerate(iterable):
+        yield index, schema.validate(dictionary)
+
+def validate_columns(validation, columns):
+    """
+    Validate columnar data, i.e. a dictionary of
+    equal-length NumPy arrays (or sequences) with
+    one entry per row, without splitting it into
+    a dictionary per row. Requires NumPy.
+
+    Range, GreaterThan, LessThan, Equals, In,
+    Blank, Truthy, Not, And, Or and Length (on
+    string arrays) are evaluated on whole columns
+    at once. Any other callable, or a built-in
+    that can't be applied to a particular column
+    (e.g. an object array of mixed types), is
+    called once per element with the same
+    semantics as `validate`. Nested validations
+    and If(Then()) need whole rows, so they
+    aren't supported here. Columns of different
+    lengths raise a ValueError.
+
+    :param validation: a mapping of keys to validators
+    :type validation: dict
+
+    :param columns: mapping of keys to columns
+    :type columns: dict
+
+    :return: a tuple containing a bool indicating
+    success or failure and a mapping of keys to
+    a mapping of error messages to an array of
+    the indices of the rows that failed with it.
+
+    """
+
+    import numpy as np
+
+    columns = dict((key, np.asarray(column)) for key, column in columns.items())
+    lengths = set(len(column) for column in columns.values())
+    if len(lengths) > 1:
+        raise ValueError("All columns must have the same length, not %s." % sorted(lengths))
+    length = lengths.pop() if lengths else 0
+    errors = {}
+    for key in validation:
+        rules = validation[key]
+        lone = not isinstance(rules, (list, tuple))
+        if lone:
+            rules = [rules]
+        # the bounds merged by `optimize` report their own messages
+        rules = [x for v in rules for x in (v.validators if type(v) is _Interval else (v,))]
+        if any(isinstance(v, (dict, If)) for v in rules):
+            raise ValueError("Nested and conditional validations can't be applied to columns.")
+        if key not in columns:
+            if Required in rules:
+                errors[key] = {"must be present": np.arange(length)}
+            elif lone:
+                # like `validate`, a lone validator fails a missing key
+                # with its own message
+                errors[key] = dict((_message(v, "err_message"), np.arange(length)) for v in rules)
+            continue
+        column = columns[key]
+        failures = {}
+        for v in rules:
+            if v == Required:
+                continue
+            failed = _failed_rows(v, column, np)
+            if len(failed):
+                msg = _message(v, "err_message")
+                if msg in failures:
+                    failed = np.union1d(failures[msg], failed)
+                failures[msg] = failed
+        if failures:
+            errors[key] = failures
+    return ValidationResult(valid=not errors, errors=errors)
+
+def _failed_rows(validator, column, np):
+    # Returns the indices of the rows of `column` that fail `validator`.
+    try:
+        mask = _column_mask(validator, column, np)
+    except Exception:
+        # e.g. comparing an object array of mixed types
+        mask = None
+    if mask is not None:
+        return np.flatnonzero(~mask)
+    failed = []
+    errors = defaultdict(list)
+    for index, value in enumerate(column.tolist()):
+        _validate_and_store_errs(validator, {0: value}, 0, errors)
+        if errors:
+            failed.append(index)
+            errors.clear()
+    return np.array(failed, dtype=np.intp)
+
+def _column_mask(v, column, np):
+    # Returns a boolean array that is True for the rows of `column`
+    # that pass `v`, or None if `v` has to be called per element.
+    # Exact types only, since a subclass may have overridden __call__.
+    t = type(v)
+    text = column.dtype.kind in "US"
+    if column.dtype.kind == "O":
+        return None
+    if t is Range:
+        if v.inclusive:
+            return (v.start <= column) & (column <= v.end)
+        return (v.start < column) & (column < v.end)
+    if t is GreaterThan:
+        return (v.lower_bound <= column) if v.inclusive else (v.lower_bound < column)
+    if t is LessThan:
+        return (column <= v.upper_bound) if v.inclusive else (column < v.upper_bound)
+    if t is Equals and np.isscalar(v.obj):
+        return column == v.obj
+    if t is In:
+        # `in` on a string is a substring test, not membership
+        if not isinstance(v.collection, (list, tuple, set, frozenset)):
+            return None
+        # only when both sides are numbers or both are the same kind
+        # of string, since NumPy would otherwise coerce them to some
+        # common type
+        collection = np.asarray(list(v.collection))
+        kinds = (collection.dtype.kind in "US", column.dtype.kind in "US")
+        if kinds[0] and collection.dtype.kind != column.dtype.kind:
+            return None
+        if collection.dtype.kind in "biufUS" and kinds[0] == kinds[1]:
+            return np.isin(column, collection)
+        return None
+    if t is Blank:
+        return column == "" if text else np.zeros(len(column), dtype=bool)
+    if t is Truthy:
+        if text:
+            return np.char.str_len(column) > 0
+        return column.astype(bool)
+    if t is Length and text:
+        lengths = np.char.str_len(column)
+        if v.maximum:
+            return (v.minimum <= lengths) & (lengths <= v.maximum)
+        return v.minimum <= lengths
+    if t is Not:
+        mask = _column_mask(v.validator, column, np)
+        return None if mask is None else ~mask
+    if t is And or t is Or:
+        combined = np.full(len(column), t is And)
+        for child in v.validators:
+            mask = _column_mask(child, column, np)
+            if mask is None:
+                return None
+            combined = (combined & mask) if t is And else (combined | mask)
+        return combined
+    return None
+
+def validate_parallel(validation, records, workers=None, chunksize=1000, backend="plan"):
+    """
+    Validate an iterable of dictionaries across a
+    pool of worker processes, for batches too big
+    for one core to get through quickly.
+
+    Every worker process receives the validation
+    once, when it starts, and compiles it with the
+    given backend. Records are then sent to the
+    workers in chunks of `chunksize`. Everything
+    in the validation must be picklable, which
+    rules out lambdas and other local functions.
+
+    :param validation: a mapping of keys to validators,
+    a CompiledSchema produced by `compile` or a OneOf
+    :type validation: dict
+
+    :param records: the dictionaries to be validated
+    :type records: any iterable of dicts
+
+    :param workers: number of worker processes,
+    defaults to the number of CPUs
+    :type workers: int
+
+    :return: a generator of (index, ValidationResult)
+    tuples, in the same order as `records`.
+
+    """
+
+    if isinstance(validation, CompiledSchema):
+        backend = _backend_name(validation)
+        validation = validation.validation
+    import multiprocessing
+    pool = multiprocessing.Pool(workers, _init_worker, (validation, backend))
+    try:
+        for offset, results in pool.imap(_validate_chunk, _chunks(records, chunksize)):
+            for index, result in enumerate(results, offset):
+                yield index, result
+        pool.close()
+    finally:
+        pool.terminate()
+
+# The schema used by _validate_chunk inside a worker process.
+_worker_schema = None
+
+def _init_worker(validation, backend):
+    global _worker_schema
+    _worker_schema = compile(validation, backend)
+
+def _validate_chunk(chunk):
+    offset, records = chunk
+    return offset, [_worker_schema.validate(record) for record in records]
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    offset = 0
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield offset, chunk
+        offset += len(chunk)
+
+def _backend_name(schema):
+    for name, cls in _backends.items():
+        if type(schema) is cls:
+            return name
+    raise ValueError("Unknown compile backend for %r." % (schema,))
+
+def is_valid(validation, dictionary):
+    """
+    Check whether a dictionary passes a validation
+    without building any error messages, stopping
+    at the first failure. Always agrees with the
+    `valid` part of what `validate` returns.
+
+    The validation is compiled for every call, so
+    when checking lots of dictionaries, compile it
+    once and use CompiledSchema.is_valid instead.
+
+    :param validation: a mapping of keys to validators,
+    a CompiledSchema produced by `compile` or a OneOf
+    :type validation: dict
+
+    :param dictionary: dictionary to be validated
+    :type dictionary: dict
+
+    :return: True if the dictionary is valid
+
+    """
+
+    return compile(validation).is_valid(dictionary)
+
+def revalidate(previous_result, validation, dictionary, changed_keys):
+    """
+    Validate a dictionary that has only changed
+    in a few keys since it was validated, e.g. by
+    a PATCH request, reusing the previous result.
+    Only the validators of the changed keys are
+    run again, along with those of keys with
+    If(Then()) rules whose Then clause looks at a
+    changed key. The result is the same as
+    validating the whole dictionary again.
+
+    Compile the validation once and pass the
+    CompiledSchema, so that the cost is down to
+    the size of the change.
+
+    # Example:
+        result = validate(schema, document)
+        document.update(patch)
+        result = revalidate(result, schema, document, patch.keys())
+
+    :param previous_result: what validating the dictionary
+    returned before it was changed
+    :type previous_result: ValidationResult
+
+    :param validation: a mapping of keys to validators,
+    or a CompiledSchema produced by `compile`
+    :type validation: dict
+
+    :param dictionary: the changed dictionary
+    :type dictionary: dict
+
+    :param changed_keys: the keys that were added,
+    changed or removed
+    :type changed_keys: iterable
+
+    :return: a ValidationResult, like `validate`
+
+    """
+
+    if isinstance(validation, OneOf):
+        raise ValueError("revalidate can't tell which validation a change affects in a OneOf; "
+                         "use validate, or revalidate with the validation it picks.")
+    schema = compile(validation)
+    dependents = schema._dependents()
+    affected = set(dependents.get(None, ()))
+    for key in changed_keys:
+        affected.update(dependents.get(key, ()))
+    plan = [schema.plan[index] for index in sorted(affected)]
+    rerun = set(key for key, _, _, _ in plan)
+    errors = defaultdict(list)
+    for key, errs in previous_result.errors.items():
+        if key not in rerun:
+            errors[key] = errs
+    _collect_plan(plan, dictionary, errors)
+    if len(errors) > 0:
+        return ValidationResult(valid=False, errors=dict(errors))
+    else:
+        return ValidationResult(valid=True, errors={})
+
+def memory_report(validation):
+    """
+    Measure how much memory a validation takes up:
+    the validation's own dicts and lists, every
+    validator in it, and everything those refer to,
+    such as collections, bounds, error messages and
+    compiled regexes. Objects that appear several
+    times are only counted once. Functions and
+    classes count for their own size but their
+    contents are not followed.
+
+    Sizes come from sys.getsizeof, so they are
+    approximate but good for comparisons.
+
+    :param validation: a mapping of keys to validators,
+    or a CompiledSchema produced by `compile`
+    :type validation: dict
+
+    :return: a MemoryReport of the total size in
+    bytes, the number of objects counted and the
+    bytes taken by each type of object
+
+    """
+
+    seen = set()
+    by_type = defaultdict(int)
+    stack = [validation]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size = sys.getsizeof(obj)
+        by_type[type(obj).__name__] += size
+        if isinstance(obj, (type, types.FunctionType, types.BuiltinFunctionType, types.ModuleType)):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            for cls in type(obj).__mro__:
+                for name in cls.__dict__.get("__slots__", ()):
+                    if name not in ("__dict__", "__weakref__") and hasattr(obj, name):
+                        stack.append(getattr(obj, name))
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+    return MemoryReport(sum(by_type.values()), len(seen), dict(by_type))
+
+def optimize(validation):
+    """
+    Rewrite a validation into a cheaper one that
+    gives the same results and error messages.
+    Meant for validations generated by code,
+    which tend to be full of redundancy:
+
+      - Not(Not(x)) becomes x
+      - And(And(a, b), c) becomes And(a, b, c),
+        and likewise for Or
+      - children repeated in an And or Or are
+        only checked once
+      - In with a single element becomes Equals
+      - a run of Range, GreaterThan and LessThan
+        validators with numeric bounds on the same
+        key is merged into a single check that
+        numbers can pass with one comparison
+
+    Rewritten validators keep the messages of the
+    ones they replace. The one difference is with
+    fail_fast, which stops after a merged run of
+    bounds rather than after the first of them
+    that fails. Nested validations, If(Then()),
+    Each and the validations of a OneOf are
+    optimized too. The validation given isn't
+    modified.
+
+    :param validation: a mapping of keys to validators
+    or a OneOf
+    :type validation: dict
+
+    :return: the optimized validation
+
+    """
+
+    return _optimize_validation(validation, {})
+
+def _optimize_validation(validation, memo):
+    # memo maps the ids of the validations optimized so
+    # far to their optimized copies, for cyclic validations.
+    if isinstance(validation, OneOf):
+        return _optimize_one_of(validation, memo)
+    optimized = memo.get(id(validation))
+    if optimized is not None:
+        return optimized
+    optimized = memo[id(validation)] = {}
+    for key, rules in validation.items():
+        if isinstance(rules, (list, tuple)):
+            rules = _merge_bounds([_optimize_validator(v, memo) for v in rules])
+        else:
+            rules = _optimize_validator(rules, memo)
+        optimized[key] = rules
+    return optimized
+
+def _optimize_one_of(v, memo):
+    # Compiled validations are kept as they are.
+    schemas = dict((value, _optimize_validator(schema, memo)) for value, schema in v.schemas.items())
+    optimized = OneOf(v.discriminator, schemas)
+    optimized.unknown_message = v.unknown_message
+    return optimized
+
+# Validators that only ever return something true or false,
+# which are the only ones Not, And and Or can be folded around.
+_PREDICATES = frozenset([In, Not, Range, GreaterThan, LessThan, Equals, Blank, Truthy,
+                         InstanceOf, SubclassOf, Pattern, Url, Or, And, Length, Contains, Email])
+
+def _optimize_validator(v, memo):
+    t = type(v)
+    if isinstance(v, dict):
+        return _optimize_validation(v, memo)
+    if t is If and type(v.then_clause) is Then:
+        return If(_optimize_validator(v.validator, memo),
+                  Then(_optimize_validation(v.then_clause.validation, memo)))
+    if t is OneOf:
+        return _optimize_one_of(v, memo)
+    if t is Each:
+        if isinstance(v.validations, (dict, OneOf)):
+            validations = _optimize_validation(v.validations, memo)
+        else:
+            validations = type(v.validations)(_optimize_validator(x, memo) for x in v.validations)
+        return Each(validations, stream=v.stream, max_errors=v.max_errors, aggregate=v.aggregate)
+    if t is Not:
+        inner = _optimize_validator(v.validator, memo)
+        if type(inner) is Not and type(inner.validator) in _PREDICATES:
+            folded = inner.validator
+            # messages that haven't been set, built or copied
+            # are the folded validator's by construction
+            if not any(hasattr(x, slot) for x in (v, inner) for slot in ("_err_message", "_not_message")):
+                return folded
+            if (folded.err_message, folded.not_message) == (v.err_message, v.not_message):
+                return folded
+        if inner is v.validator:
+            return v
+        return _keep_messages(_fresh(Not, inner), v)
+    if t is And or t is Or:
+        children = []
+        for child in v.validators:
+            child = _optimize_validator(child, memo)
+            # And(And(a, b), c) is And(a, b, c), and likewise for Or
+            flatten = type(child) is t and child.adaptive is None
+            grandchildren = child.validators if flatten else (child,)
+            for x in grandchildren:
+                if not any(x is seen for seen in children):
+                    children.append(x)
+        if len(children) == len(v.validators) and all(a is b for a, b in zip(children, v.validators)):
+            return v
+        return _keep_messages(_fresh(t, *children, adaptive=v.adaptive is not None), v)
+    if t is In and isinstance(v.collection, (list, tuple, set, frozenset)) and len(v.collection) == 1:
+        element = next(iter(v.collection))
+        # Equals compares the other way around, which only
+        # surely makes no difference for these types
+        if type(element) in (int, str, bytes, type(None)) or _isstr(element):
+            return _keep_messages(_fresh(Equals, element), v)
+    return v
+
+def _fresh(cls, *args, **kwargs):
+    # A new instance even inside `interning`, since _keep_messages
+    # sets its messages, which would change them for everyone
+    # sharing an interned one.
+    validator = object.__new__(cls)
+    validator.__init__(*args, **kwargs)
+    return validator
+
+def _keep_messages(new, old):
+    # Messages that haven't been built yet are only copied over
+    # when they're first read, as building them can be costly,
+    # e.g. for an In with a big collection.
+    for name in ("err_message", "not_message"):
+        if _built_message(old, name) or not isinstance(getattr(type(new), name, None), _lazy_message):
+            setattr(new, name, getattr(old, name))
+        else:
+            setattr(new, name, _DeferredMessage(old, name))
+    return new
+
+def _merge_bounds(rules):
+    # Replaces every run of two or more Range, GreaterThan and
+    # LessThan validators with int or float bounds by an _Interval.
+    merged = []
+    run = []
+    for v in rules + [None]:
+        if _bounds(v) is not None:
+            run.append(v)
+            continue
+        if len(run) > 1:
+            merged.append(_Interval(run))
+        else:
+            merged.extend(run)
+        run = []
+        if v is not None:
+            merged.append(v)
+    return merged
+
+def _bounds(v):
+    # Returns the (lower, upper) bounds of a Range, GreaterThan or
+    # LessThan validator as (bound, inclusive) pairs, or None.
+    t = type(v)
+    if t is Range:
+        bounds = ((v.start, v.inclusive), (v.end, v.inclusive))
+    elif t is GreaterThan:
+        bounds = ((v.lower_bound, v.inclusive), None)
+    elif t is LessThan:
+        bounds = (None, (v.upper_bound, v.inclusive))
+    else:
+        return None
+    for bound in bounds:
+        if bound is not None and type(bound[0]) not in (int, float):
+            return None
+    return bounds
+
+class _Interval(Validator):
+    # Stands in for a run of Range, GreaterThan and LessThan validators
+    # on the same key, made by `optimize`. An int or float inside all
+    # of them passes with one chained comparison against the tightest
+    # bounds; anything else goes through each of them in turn, so that
+    # the same messages are reported as before.
+
+    __slots__ = ("validators", "lower", "lower_inclusive", "upper", "upper_inclusive")
+
+    def __init__(self, validators):
+        self.validators = tuple(validators)
+        self.lower, self.lower_inclusive = float("-inf"), False
+        self.upper, self.upper_inclusive = float("inf"), False
+        for lower, upper in map(_bounds, self.validators):
+            # of two equal bounds, the exclusive one is tighter
+            if lower is not None and (lower[0], not lower[1]) > (self.lower, not self.lower_inclusive):
+                self.lower, self.lower_inclusive = lower
+            if upper is not None and (upper[0], upper[1]) < (self.upper, self.upper_inclusive):
+                self.upper, self.upper_inclusive = upper
+
+    def __call__(self, value):
+        if type(value) is int or type(value) is float:
+            if self.lower_inclusive:
+                passes = self.lower <= value
+            else:
+                passes = self.lower < value
+            if passes and (value <= self.upper if self.upper_inclusive else value < self.upper):
+                return True
+        errors = []
+        for v in self.validators:
+            try:
+                valid = v(value)
+            except Exception:
+                valid = False
+            if not valid:
+                errors.append(v.err_message)
+        return (not errors, errors)
+
+def compile(validation, backend="plan", key_order=None):
+    """
+    Analyze a validation once and return a
+    CompiledSchema that can be used to validate
+    any number of dictionaries without inspecting
+    the validation again.
+
+    With backend="codegen", the validation is
+    instead turned into Python source with the
+    built-in validators inlined, which is then
+    exec'd into a function. See GeneratedSchema.
+
+    Compiling a CompiledSchema, or a OneOf, whose
+    validations are compiled when it's created,
+    just returns it.
+
+    # Example:
+        schema = compile({
+            "foo": [Required, Equals(1)]
+        })
+        schema.validate({"foo": 1})
+        # ValidationResult(valid=True, errors={})
+
+    """
+
+    if isinstance(validation, OneOf):
+        if key_order is not None:
+            raise ValueError("A OneOf has no keys of its own to order; "
+                             "give the validations in its schemas a key_order instead.")
+        return validation
+    if isinstance(validation, CompiledSchema):
+        return validation
+    try:
+        cls = _backends[backend]
+    except KeyError:
+        raise ValueError("Unknown compile backend %r." % (backend,))
+    schema = cls(validation)
+    schema.key_order = key_order
+    return schema
+
+# The kinds of step a key's validators are sorted into
+# when a validation is compiled. Each step is stored as a
+# (kind, validator, schema) tuple, where schema is the
+# precompiled sub-validation for the kinds that have one.
+_PLAIN, _NESTED, _IF, _EACH = range(4)
+
+class CompiledSchema(object):
+    """
+    A validation that has been analyzed into a
+    flat execution plan: the set of required keys
+    and, for every key, a tuple of its validators
+    already classified as plain, nested, If or Each.
+    Nested validations, Then clauses and the
+    dictionaries given to Each are compiled as well.
+
+    Results are identical to calling `validate`
+    with the original validation. Use `compile`
+    rather than instantiating this directly.
+
+    Set `key_order` to a KeyOrder to have
+    validate(fail_fast=True) and is_valid check
+    the keys in the order it has learned.
+
+    """
+
+    def __init__(self, validation, _memo=None):
+        # _memo maps the id of every validation compiled so far
+        # to its CompiledSchema, so that cyclic validations
+        # don't recurse forever.
+        if _memo is None:
+            _memo = {}
+        _memo[id(validation)] = self
+        self.validation = validation
+        self.plan = tuple(self._compile_rule(key, validation[key], _memo) for key in validation)
+        self.required = frozenset(key for key, required, _, _ in self.plan if required)
+        self._dependents_map = None
+        self.key_order = None
+        self._ordered_plan = (None, None)
+
+    def validate(self, dictionary, fail_fast=False):
+        """
+        Validate a dictionary against the compiled
+        validation. Returns a ValidationResult just
+        like `validate`, including its fail_fast option.
+
+        """
+
+        profiler = _current_profiler()
+        if profiler is None:
+            if fail_fast and self.key_order is not None:
+                errors = self.key_order._collect(self, dictionary)
+            else:
+                errors = self._collect(dictionary, None, fail_fast)
+        else:
+            errors = _ProfiledSchema(self, profiler, ())._collect(dictionary, None, fail_fast)
+        if len(errors) > 0:
+            # `errors` gets downgraded from defaultdict to dict
+            # because it makes for prettier output
+            return ValidationResult(valid=False, errors=dict(errors))
+        else:
+            return ValidationResult(valid=True, errors={})
+
+    def is_valid(self, dictionary):
+        """
+        Return whether a dictionary passes the compiled
+        validation, without building any error messages.
+        See `is_valid`.
+
+        """
+
+        if self.key_order is not None:
+            return self.key_order._is_valid(self, dictionary)
+        return self._check(dictionary)
+
+    def _check(self, dictionary):
+        return _check_plan(self.plan, dictionary)
+
+    def _collect(self, dictionary, errors=None, fail_fast=False):
+        # `errors` lets batch callers reuse one defaultdict
+        # across many dictionaries instead of making a new one.
+        return _collect_plan(self.plan, dictionary, errors, fail_fast)
+
+    def _dependents(self):
+        # Maps every key that the validation looks at to the set of
+        # positions in the plan whose errors can change when it does.
+        # A key's errors depend on the key itself and on the keys looked
+        # at by the Then clauses of its If rules. Under None are the
+        # positions of If rules we can't see into, which depend on
+        # every key.
+        if self._dependents_map is None:
+            dependents = defaultdict(set)
+            for index, (key, _, _, steps) in enumerate(self.plan):
+                dependents[key].add(index)
+                for kind, _, schema in steps:
+                    if kind != _IF:
+                        continue
+                    looked_at = _looked_at(schema, set()) if schema is not None else None
+                    if looked_at is None:
+                        dependents[None].add(index)
+                        continue
+                    for other in looked_at:
+                        dependents[other].add(index)
+            self._dependents_map = dict(dependents)
+        return self._dependents_map
+
+    def _compile_rule(self, key, rules, memo):
+        # Returns a (key, required, guarded, steps) tuple. Keys with a
+        # list of rules are skipped when missing from the dictionary
+        # (guarded), while a lone validator is always applied, and
+        # reports its own error message if the key is missing.
+        if isinstance(rules, (list, tuple)):
+            steps = tuple(self._compile_step(v, memo) for v in rules if not v == Required)
+            return (key, Required in rules, True, steps)
+        if rules == Required:
+            return (key, True, True, ())
+        return (key, False, False, ((_PLAIN, rules, None),))
+
+    def _compile_step(self, v, memo):
+        if isinstance(v, dict):
+            return (_NESTED, v, self._compile_nested(v, memo))
+        if isinstance(v, If):
+            # subclasses might do something different when called,
+            # so only take apart the If(Then()) form we know about.
+            if type(v) is If and type(v.then_clause) is Then:
+                return (_IF, v, self._compile_nested(v.then_clause.validation, memo))
+            return (_IF, v, None)
+        if type(v) is Each:
+            if isinstance(v.validations, dict):
+                return (_EACH, v, self._compile_nested(v.validations, memo))
+            return (_EACH, v, None)
+        return (_PLAIN, v, None)
+
+    def _compile_nested(self, validation, memo):
+        if isinstance(validation, (CompiledSchema, OneOf)):
+            return validation
+        schema = memo.get(id(validation))
+        if schema is None:
+            schema = type(self)(validation, memo)
+        return schema
+
+def _collect_plan(plan, dictionary, errors=None, fail_fast=False):
+    # Validates a dictionary against the (key, required, guarded, steps)
+    # entries of a plan, or some of them, adding to `errors`.
+    if errors is None:
+        errors = defaultdict(list)
+    for key, required, guarded, steps in plan:
+        # don't break on optional keys
+        if guarded and key not in dictionary:
+            if required:
+                errors[key] = ["must be present"]
+                if fail_fast:
+                    return errors
+            continue
+        for step in steps:
+            if step[0] == _PLAIN:
+                _validate_and_store_errs(step[1], dictionary, key, errors)
+            else:
+                _run_step(step, dictionary, key, errors, fail_fast)
+            if fail_fast and errors:
+                return errors
+    return errors
+
+def _check_plan(plan, dictionary):
+    # The predicate version of _collect_plan.
+    for key, required, guarded, steps in plan:
+        if guarded and key not in dictionary:
+            if required:
+                return False
+            continue
+        for step in steps:
+            if not _check_step(step, dictionary, key):
+                return False
+    return True
+
+class KeyOrder(object):
+    """
+    Learns which order to check the keys of a
+    validation in so that failing dictionaries
+    are rejected with the least work: cheap keys
+    that often fail first. Set it as the key_order
+    of a CompiledSchema and it's used, and learned
+    from, by validate(fail_fast=True) and is_valid.
+
+    Every SAMPLE_EVERY-th dictionary has all of
+    its keys checked, timing each one and noting
+    whether it fails; the order is worked out again
+    from those samples every REORDER_EVERY calls.
+    Which errors fail_fast reports depends on the
+    order, but whether a dictionary is valid
+    never does.
+
+    Use dump() to save what it has learned, e.g.
+    as JSON, and KeyOrder.load() to pick up from
+    there after a restart.
+
+    # Example:
+        schema = compile(validation, key_order=KeyOrder())
+        schema.validate(dictionary, fail_fast=True)
+        json.dump(schema.key_order.dump(), f)
+        ...
+        order = KeyOrder.load(json.load(f))
+
+    """
+
+    SAMPLE_EVERY = 16
+    REORDER_EVERY = 1024
+
+    def __init__(self):
+        self.order = ()
+        self.calls = 0
+        self.samples = 0
+        # key -> [seconds spent on it, times it failed]
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def dump(self):
+        """
+        Return what has been learned as plain
+        lists and dicts, for KeyOrder.load.
+
+        """
+
+        with self._lock:
+            return {
+                "order": list(self.order),
+                "samples": self.samples,
+                "stats": [[key, stats[0], stats[1]] for key, stats in self.stats.items()],
+            }
+
+    @classmethod
+    def load(cls, data):
+        """
+        Make a KeyOrder from the output of dump().
+
+        """
+
+        key_order = cls()
+        key_order.order = tuple(_hashable(key) for key in data["order"])
+        key_order.samples = data["samples"]
+        for key, elapsed, failures in data["stats"]:
+            key_order.stats[_hashable(key)] = [elapsed, failures]
+        return key_order
+
+    def _plan(self, schema):
+        # The schema's plan, sorted into the learned order. Keys that
+        # haven't been ordered yet keep their place after those that have.
+        order, plan = schema._ordered_plan
+        if order is not self.order:
+            position = dict((key, i) for i, key in enumerate(self.order))
+            plan = tuple(sorted(schema.plan, key=lambda entry: position.get(entry[0], len(position))))
+            schema._ordered_plan = (self.order, plan)
+        return plan
+
+    def _collect(self, schema, dictionary):
+        self.calls += 1
+        if self.calls % self.SAMPLE_EVERY == 0:
+            failures = self._sample(schema, dictionary, lambda entry: _collect_plan((entry,), dictionary, None, True))
+            for entry in self._plan(schema):
+                if failures.get(entry[0]):
+                    return failures[entry[0]]
+            return defaultdict(list)
+        return _collect_plan(self._plan(schema), dictionary, None, True)
+
+    def _is_valid(self, schema, dictionary):
+        self.calls += 1
+        if self.calls % self.SAMPLE_EVERY == 0:
+            failures = self._sample(schema, dictionary, lambda entry: not _check_plan((entry,), dictionary))
+            return not any(failures.values())
+        return _check_plan(self._plan(schema), dictionary)
+
+    def _sample(self, schema, dictionary, fails):
+        # Runs fails(entry) for every entry of the plan, recording how
+        # long it took and whether it failed, and returns the results.
+        results = {}
+        timings = []
+        for entry in schema.plan:
+            start = _timer()
+            results[entry[0]] = failed = fails(entry)
+            timings.append((entry[0], _timer() - start, bool(failed)))
+        with self._lock:
+            for key, elapsed, failed in timings:
+                stats = self.stats.setdefault(key, [0.0, 0])
+                stats[0] += elapsed
+                stats[1] += failed
+            self.samples += 1
+            if self.samples % (self.REORDER_EVERY // self.SAMPLE_EVERY) == 0:
+                self._reorder()
+        return results
+
+    def _reorder(self):
+        # Checking keys by increasing cost per failure minimizes the
+        # expected cost of finding a failure. Keys that never failed
+        # are left out, and so keep their place at the end.
+        failing = [key for key, stats in self.stats.items() if stats[1]]
+        self.order = tuple(sorted(failing, key=lambda key: self.stats[key][0] / self.stats[key][1]))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+def _hashable(key):
+    # JSON turns tuple keys into lists
+    if isinstance(key, list):
+        return tuple(_hashable(item) for item in key)
+    return key
+
+def _looked_at(schema, seen):
+    # Returns the keys of a dictionary that a Then clause's compiled
+    # validation looks at, including through its own If rules, or None
+    # if that can't be known.
+    if id(schema) in seen:
+        return set()
+    seen.add(id(schema))
+    if isinstance(schema, OneOf):
+        keys = set([schema.discriminator])
+        for sub in schema.compiled.values():
+            sub_keys = _looked_at(sub, seen)
+            if sub_keys is None:
+                return None
+            keys |= sub_keys
+        return keys
+    keys = set()
+    for key, _, _, steps in schema.plan:
+        keys.add(key)
+        for kind, _, sub in steps:
+            if kind == _IF:
+                sub_keys = _looked_at(sub, seen) if sub is not None else None
+                if sub_keys is None:
+                    return None
+                keys |= sub_keys
+    return keys
+
+def _run_step(step, dictionary, key, errors, fail_fast=False):
+    # Applies a nested, If or Each step of a compiled plan.
+    kind, v, schema = step
+    if kind == _NESTED:
+        nested_errors = schema._collect(dictionary[key], None, fail_fast)
+        if nested_errors:
+            errors[key].append(dict(nested_errors))
+    elif kind == _IF:
+        # if the If() condition passed and there were errors
+        # in the second set of rules, then add them to the
+        # list of errors for the key with the condtional
+        # as a nested dictionary of errors.
+        if schema is None:
+            conditional, dependent = v(dictionary[key], dictionary)
+            if conditional and dependent[1]:
+                errors[key].append(dependent[1])
+        elif v.validator(dictionary[key]):
+            dependent = schema._collect(dictionary, None, fail_fast)
+            if dependent:
+                errors[key].append(dict(dependent))
+    elif kind == _EACH:
+        try:
+            value = dictionary[key]
+            if isinstance(value, v.accepts):
+                valid = v._apply(value, schema, fail_fast)
+            else:
+                valid = (False, v.err_message)
+        except Exception:
+            valid = (False, v.err_message)
+        _store_errs(v, valid, key, errors)
+    else:
+        _validate_and_store_errs(v, dictionary, key, errors)
+
+def _check_step(step, dictionary, key):
+    # The predicate version of _run_step and _validate_and_store_errs:
+    # returns False exactly when they would have stored an error.
+    kind, v, schema = step
+    if kind == _PLAIN:
+        accepts = getattr(v, "accepts", None)
+        try:
+            value = dictionary[key]
+            if accepts is not None and not isinstance(value, accepts):
+                return not v.err_message
+            if isinstance(v, OneOf):
+                # without the errors that calling it builds
+                return v._check(value)
+            valid = v(value)
+        except Exception:
+            return not v.err_message
+        if isinstance(valid, tuple):
+            valid, errs = valid
+            return not errs
+        return bool(valid)
+    if kind == _NESTED:
+        return schema._check(dictionary[key])
+    if kind == _IF:
+        if schema is None:
+            conditional, dependent = v(dictionary[key], dictionary)
+            return not (conditional and dependent[1])
+        if v.validator(dictionary[key]):
+            return schema._check(dictionary)
+        return True
+    try:
+        value = dictionary[key]
+        return isinstance(value, v.accepts) and v._check(value, schema)
+    except Exception:
+        return not v.err_message
+
+class GeneratedSchema(CompiledSchema):
+    """
+    A CompiledSchema that generates and exec's
+    Python source specialized to its validation.
+
+    Built-in validators (Range, GreaterThan,
+    LessThan, Equals, Length, InstanceOf,
+    Truthy, Blank, Not, And and Or) are inlined
+    as plain comparisons. A second
+    function is generated for `is_valid`. Anything else,
+    including subclasses of the built-ins, is
+    called just like `validate` would call it.
+    The generated source is kept in `source`.
+
+    Use compile(validation, backend="codegen")
+    rather than instantiating this directly.
+
+    """
+
+    def __init__(self, validation, _memo=None):
+        super(GeneratedSchema, self).__init__(validation, _memo)
+        self.source, namespace = _generate(self.plan)
+        code = builtins.compile(self.source, "<validator codegen>", "exec")
+        exec(code, namespace)
+        # shadows the plan-walking methods with the generated functions
+        self._collect = namespace["_collect"]
+        self._check = namespace["_is_valid"]
+
+_backends = {
+    "plan": CompiledSchema,
+    "codegen": GeneratedSchema
+}
+
+def _generate(plan):
+    # Returns the source of `_collect(d)` and `_is_valid(d)` functions
+    # that do the same work as the CompiledSchema methods of the same
+    # names for this plan, along with the namespace they must be exec'd
+    # in. Every object the code refers to is bound in the namespace
+    # under a generated name rather than written out as a literal.
+    namespace = {
+        "_defaultdict": defaultdict,
+        "_validate_and_store_errs": _validate_and_store_errs,
+        "_run_step": _run_step,
+        "_check_step": _check_step,
+        "_message": _message,
+    }
+
+    def bind(obj):
+        name = "_c%d" % len(namespace)
+        namespace[name] = obj
+        return name
+
+    lines = [
+        "def _collect(d, errors=None, fail_fast=False):",
+        "    if errors is None:",
+        "        errors = _defaultdict(list)",
+    ]
+    for key, required, guarded, steps in plan:
+        k = bind(key)
+        if guarded and not steps:
+            if required:
+                lines.append("    if %s not in d:" % k)
+                lines.append("        errors[%s] = ['must be present']" % k)
+                lines.append("        if fail_fast:")
+                lines.append("            return errors")
+            continue
+        indent = "    "
+        if guarded:
+            lines.append("    if %s in d:" % k)
+            indent = "        "
+        for step in steps:
+            kind, v = step[0], step[1]
+            expr = _inline_checked(v, bind) if kind == _PLAIN else None
+            if expr is None:
+                if kind == _PLAIN:
+                    lines.append(indent + "_validate_and_store_errs(%s, d, %s, errors)" % (bind(v), k))
+                else:
+                    lines.append(indent + "_run_step(%s, d, %s, errors, fail_fast)" % (bind(step), k))
+                lines.append(indent + "if fail_fast and errors:")
+                lines.append(indent + "    return errors")
+                continue
+            # A validator that raises is a failure with its normal
+            # error message, so both branches report the same thing.
+            # That includes looking the value up, which fails for a
+            # missing key of a lone validator or a `d` that isn't a
+            # dictionary, and taking its truth value.
+            lines.extend([
+                indent + "try:",
+                indent + "    value = d[%s]" % k,
+                indent + "    valid = bool(%s)" % expr,
+                indent + "except Exception:",
+                indent + "    valid = False",
+                indent + "if not valid:",
+                indent + "    errors[%s].append(_message(%s, 'err_message'))" % (k, bind(v)),
+                indent + "    if fail_fast:",
+                indent + "        return errors",
+            ])
+        if guarded and required:
+            lines.append("    else:")
+            lines.append("        errors[%s] = ['must be present']" % k)
+            lines.append("        if fail_fast:")
+            lines.append("            return errors")
+    lines.append("    return errors")
+
+    lines.append("def _is_valid(d):")
+    for key, required, guarded, steps in plan:
+        k = bind(key)
+        indent = "    "
+        if guarded and not steps:
+            if required:
+                lines.append("    if %s not in d:" % k)
+                lines.append("        return False")
+            continue
+        if guarded:
+            lines.append("    if %s not in d:" % k)
+            lines.append("        %s" % ("return False" if required else "pass"))
+            lines.append("    else:")
+            indent = "        "
+        for step in steps:
+            kind, v = step[0], step[1]
+            expr = _inline_checked(v, bind) if kind == _PLAIN else None
+            if expr is None:
+                lines.append(indent + "if not _check_step(%s, d, %s):" % (bind(step), k))
+                lines.append(indent + "    return False")
+                continue
+            lines.extend([
+                indent + "try:",
+                indent + "    value = d[%s]" % k,
+                indent + "    if not (%s):" % expr,
+                indent + "        return False",
+                indent + "except Exception:",
+                indent + "    return False",
+            ])
+    lines.append("    return True")
+    return "\n".join(lines) + "\n", namespace
+
+def _inline(v, bind):
+    # Returns a Python expression equivalent to calling `v` on the
+    # name `value`, or None if `v` isn't one of the built-in
+    # validators that can be inlined. Exact types only, since a
+    # subclass may well have overridden __call__.
+    t = type(v)
+    if t is Range:
+        op = "<=" if v.inclusive else "<"
+        return "%s %s value %s %s" % (bind(v.start), op, op, bind(v.end))
+    if t is GreaterThan:
+        return "%s %s value" % (bind(v.lower_bound), "<=" if v.inclusive else "<")
+    if t is LessThan:
+        return "value %s %s" % ("<=" if v.inclusive else "<", bind(v.upper_bound))
+    if t is Equals:
+        return "value == %s" % bind(v.obj)
+    if t is Length:
+        if v.maximum:
+            return "%s <= len(value) <= %s" % (bind(v.minimum), bind(v.maximum))
+        return "%s <= len(value)" % bind(v.minimum)
+    if t is InstanceOf:
+        return "isinstance(value, %s)" % bind(v.base_class)
+    if t is Truthy:
+        return "value"
+    if t is Blank:
+        return "value == ''"
+    if t is Not:
+        return "not (%s)" % _inline_operand(v.validator, bind)
+    if (t is And or t is Or) and v.adaptive is not None:
+        return None
+    if t is And:
+        if not v.validators:
+            return "True"
+        return " and ".join("(%s)" % _inline_operand(x, bind) for x in v.validators)
+    if t is Or:
+        if not v.validators:
+            return "False"
+        return " or ".join("(%s)" % _inline_operand(x, bind) for x in v.validators)
+    return None
+
+def _inline_checked(v, bind):
+    # Like _inline, but also rejects values outside of the
+    # validator's `accepts` types, as _validate_and_store_errs does.
+    expr = _inline(v, bind)
+    if expr is not None and v.accepts is not None:
+        expr = "isinstance(value, %s) and (%s)" % (bind(v.accepts), expr)
+    return expr
+
+def _inline_operand(v, bind):
+    # Inside Not, And and Or anything that can't be inlined is
+    # simply called, which is all those validators do with it.
+    expr = _inline(v, bind)
+    if expr is None:
+        expr = "%s(value)" % bind(v)
+    return expr
+
+# The Profile that validate() records into in each thread, if any,
+# and how many profile() blocks are running across all threads, so
+# that validation only has to look for one while there may be one.
+_profilers = threading.local()
+_profiling = 0
+_profiling_lock = threading.Lock()
+
+def _current_profiler():
+    return getattr(_profilers, "current", None) if _profiling else None
+
+@contextlib.contextmanager
+def profile():
+    """
+    Record how much time each key and validator
+    takes while the block is running. Yields a
+    Profile, which holds the results once the
+    block has finished. Only validation in the
+    thread running the block is recorded. While
+    no block is active, validation doesn't pay
+    anything for this.
+
+    This applies to `validate` and
+    CompiledSchema.validate, but not `is_valid`.
+
+    # Example:
+        with profile() as report:
+            validate(validation, dictionary)
+        for entry in report.sorted("time")[:10]:
+            print(entry)
+
+    """
+
+    global _profiling
+    previous = getattr(_profilers, "current", None)
+    _profilers.current = report = Profile()
+    with _profiling_lock:
+        _profiling += 1
+    try:
+        yield report
+    finally:
+        _profilers.current = previous
+        with _profiling_lock:
+            _profiling -= 1
+
+class Profile(object):
+    """
+    The results of a `profile` block: a ProfileEntry
+    for every (key path, validator type) pair, with
+    the number of calls, their cumulative time in
+    seconds, and how many of them failed or raised.
+    The key path is a tuple of keys from the top of
+    the dictionary, where "*" stands for every element
+    of a list checked by Each. Time spent in nested
+    validations, If(Then()) and Each includes the
+    time spent in the validations they contain.
+
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def entries(self):
+        """
+        Return a list of every ProfileEntry.
+
+        """
+
+        with self._lock:
+            return [ProfileEntry(path, name, *stats) for (path, name), stats in self._stats.items()]
+
+    def sorted(self, by="time"):
+        """
+        Return every ProfileEntry, sorted by one of
+        their fields, largest first.
+
+        """
+
+        return sorted(self.entries(), key=lambda entry: getattr(entry, by), reverse=True)
+
+    def _record(self, path, validator, elapsed, failed, raised):
+        if isinstance(validator, dict):
+            name = "dict"
+        else:
+            name = getattr(validator, "__name__", type(validator).__name__)
+        with self._lock:
+            stats = self._stats.get((path, name))
+            if stats is None:
+                stats = self._stats[(path, name)] = [0, 0.0, 0, 0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += failed
+            stats[3] += raised
+
+class _ProfiledSchema(object):
+    # Stands in for a CompiledSchema to run its plan while recording
+    # every step into a Profile. Sub-schemas get wrapped in turn, so
+    # that nested validations, If(Then()) and Each are covered too.
+
+    def __init__(self, schema, profiler, path):
+        self.schema = schema
+        self.profiler = profiler
+        self.path = path
+
+    def _check(self, dictionary):
+        return not self._collect(dictionary, None, True)
+
+    def _collect(self, dictionary, errors=None, fail_fast=False):
+        if errors is None:
+            errors = defaultdict(list)
+        record = self.profiler._record
+        for key, required, guarded, steps in self.schema.plan:
+            path = self.path + (key,)
+            if guarded and key not in dictionary:
+                if required:
+                    errors[key] = ["must be present"]
+                    record(path, Required, 0.0, True, False)
+                    if fail_fast:
+                        return errors
+                continue
+            if required:
+                record(path, Required, 0.0, False, False)
+            for kind, v, schema in steps:
+                if isinstance(schema, CompiledSchema):
+                    sub_path = path + ("*",) if kind == _EACH else path
+                    schema = _ProfiledSchema(schema, self.profiler, sub_path)
+                before = len(errors.get(key, ()))
+                raised = False
+                start = _timer()
+                try:
+                    if kind == _PLAIN or kind == _EACH:
+                        try:
+                            value = dictionary[key]
+                            accepts = getattr(v, "accepts", None)
+                            if accepts is not None and not isinstance(value, accepts):
+                                valid = (False, v.err_message)
+                            elif kind == _PLAIN:
+                                valid = v(value)
+                            else:
+                                valid = v._apply(value, schema, fail_fast)
+                        except Exception:
+                            raised = True
+                            valid = (False, v.err_message)
+                        _store_errs(v, valid, key, errors)
+                    else:
+                        _run_step((kind, v, schema), dictionary, key, errors, fail_fast)
+                except Exception:
+                    record(path, v, _timer() - start, True, True)
+                    raise
+                record(path, v, _timer() - start, len(errors.get(key, ())) > before, raised)
+                if fail_fast and errors:
+                    return errors
+        return errors
@@ -26,15 +26,34 @@ that otherwise don't fit into the base part of the module.
 
 """
 
+import inspect
+import threading
+import weakref
+
+from validator import Validator
+
 try: # python 3
-    from inspect import getfullargspec
-    getargspec = getfullargspec
+    from inspect import signature, Parameter
 except ImportError: # python 2
     from inspect import getargspec
+    signature = None
 
-def ArgSpec(*args, **kwargs):
+class ArgSpec(Validator):
     """
-    Validate a function based on the given argspec.
+    Validate a function based on the given argspec:
+    the names of the arguments that don't have
+    defaults, in order, and the defaults of those
+    that do, whether they are positional or
+    keyword-only. Keyword-only arguments without
+    defaults are named after a "*", just like in
+    the function's signature. *args and **kwargs
+    aren't part of the argspec, so they're ignored.
+    The `self` of a method is an argument like
+    any other.
+
+    Every function's signature is only analyzed
+    the first time it's validated, and remembered
+    for as long as the function exists.
 
     # Example:
         validations = {
@@ -42,35 +61,71 @@ def ArgSpec(*args, **kwargs):
         }
         def pass_func(a, b, c, bar="baz"):
             pass
+        def also_pass_func(a, b, c, *args, bar="baz", **kwargs):
+            pass
+        def keyword_only_func(a, b, *, c, bar="baz"):
+            pass
         def fail_func(b, c, a, baz="bar"):
             pass
         passes = {"foo": pass_func}
         fails = {"foo": fail_func}
+        keyword_only = {"foo": [ArgSpec("a", "b", "*", "c", bar="baz")]}
 
     """
 
-    def argspec_lambda(value):
-        argspec = getargspec(value)
-        argspec_kw_vals = ()
-        if argspec.defaults is not None:
-            argspec_kw_vals = argspec.defaults
-        kw_vals = {}
-        arg_offset = 0
-        arg_len = len(argspec.args) - 1
-        for val in argspec_kw_vals[::-1]:
-            kw_vals[argspec.args[arg_len - arg_offset]] = val
-            arg_offset += 1
-        if kwargs == kw_vals:
-            if len(args) != arg_len - arg_offset + 1:
-                return False
-            index = 0
-            for arg in args:
-                if argspec.args[index] != arg:
-                    return False
-                index += 1
-            return True
-        return False
-    argspec_lambda.err_message = "must match argspec ({0}) {{{1}}}".format(args, kwargs)
-    # as little sense as negating this makes, best to just be consistent.
-    argspec_lambda.not_message = "must not match argspec ({0}) {{{1}}}".format(args, kwargs)
-    return argspec_lambda
+    __slots__ = ("args", "kwargs", "err_message", "not_message")
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.err_message = "must match argspec ({0}) {{{1}}}".format(args, kwargs)
+        # as little sense as negating this makes, best to just be consistent.
+        self.not_message = "must not match argspec ({0}) {{{1}}}".format(args, kwargs)
+
+    def __call__(self, value):
+        names, defaults = _argspec(value)
+        return self.kwargs == defaults and self.args == names
+
+# Maps functions to their (names, defaults) argspec. The functions are
+# only weakly referenced, so that e.g. reloaded plugins don't leak.
+_argspecs = weakref.WeakKeyDictionary()
+_argspecs_lock = threading.Lock()
+
+def _argspec(func):
+    try:
+        with _argspecs_lock:
+            return _argspecs[func]
+    except (KeyError, TypeError):
+        # not seen yet, or can't be weakly referenced (e.g. builtins)
+        pass
+    spec = _analyze(func)
+    try:
+        with _argspecs_lock:
+            _argspecs[func] = spec
+    except TypeError:
+        pass
+    return spec
+
+def _analyze(func):
+    if signature is None:
+        argspec = getargspec(func)
+        split = len(argspec.args) - len(argspec.defaults or ())
+        return tuple(argspec.args[:split]), dict(zip(argspec.args[split:], argspec.defaults or ()))
+    if inspect.ismethod(func):
+        # signature() leaves out `self`, unlike getargspec used to
+        func = func.__func__
+    names = []
+    keyword_only = []
+    defaults = {}
+    for param in signature(func).parameters.values():
+        if param.kind in (Parameter.VAR_POSITIONAL, Parameter.VAR_KEYWORD):
+            continue
+        if param.default is not Parameter.empty:
+            defaults[param.name] = param.default
+        elif param.kind == Parameter.KEYWORD_ONLY:
+            keyword_only.append(param.name)
+        else:
+            names.append(param.name)
+    if keyword_only:
+        names.append("*")
+    return tuple(names + keyword_only), defaults